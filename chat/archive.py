@@ -0,0 +1,219 @@
+import json
+import logging
+import zlib
+from datetime import datetime
+import msgpack
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import ConversationParticipant, Message, MessageArchive
+from .persistence import bulk_create_messages
+
+logger = logging.getLogger(__name__)
+
+GROUP_PREFIX = "chat_"
+# Where older releases kept each room's history, as one JSON blob in the
+# Django cache.
+LEGACY_HISTORY_KEY = "chat:{group}:messages"
+
+
+def conversation_id(group):
+    """
+    Return the conversation a room group belongs to, or None for rooms
+    whose messages are not persisted.
+    """
+    suffix = group[len(GROUP_PREFIX):] if group.startswith(GROUP_PREFIX) else ""
+    return int(suffix) if suffix.isdigit() else None
+
+
+def message_entry(message):
+    """
+    Return a ``Message`` row as a history entry, in the shape the consumer
+    appends to the history store.
+    """
+    return {
+        "seq": message.seq,
+        "user": message.sender.first_name,
+        "user_id": message.sender_id,
+        "message": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+
+def pack(entries):
+    return zlib.compress(msgpack.packb(entries))
+
+
+def unpack(data):
+    return msgpack.unpackb(zlib.decompress(data))
+
+
+class ArchivedHistory:
+    """
+    The cold tier behind the history store's Redis window.
+
+    Older entries are read from ``Message`` by sequence number, and from
+    the compressed ``MessageArchive`` blocks that ``compact_history`` packs
+    the oldest rows into. Reads return entries in the same shape as the hot
+    window, so the store can splice the two together.
+    """
+
+    @database_sync_to_async
+    def between(self, group, low, high):
+        conversation = conversation_id(group)
+        if conversation is None or high < low:
+            return []
+        entries = {}
+        blocks = MessageArchive.objects.filter(conversation_id=conversation, first_seq__lte=high, last_seq__gte=low)
+        for block in blocks:
+            for entry in unpack(block.data):
+                if low <= entry["seq"] <= high:
+                    entries[entry["seq"]] = entry
+        rows = Message.objects.filter(conversation_id=conversation, seq__range=(low, high)).select_related("sender")
+        for message in rows:
+            entries[message.seq] = message_entry(message)
+        return [entries[seq] for seq in sorted(entries)]
+
+    async def latest(self, group, limit):
+        last = await self.last_seq(group)
+        if not last:
+            return []
+        return await self.between(group, max(last - limit + 1, 1), last)
+
+    @database_sync_to_async
+    def last_seq(self, group):
+        """
+        Return the highest sequence number stored for ``group``, which is
+        where its counter resumes once the room is out of Redis.
+        """
+        conversation = conversation_id(group)
+        if conversation is None:
+            return 0
+        stored = Message.objects.filter(conversation_id=conversation).aggregate(seq=Max("seq"))["seq"]
+        archived = MessageArchive.objects.filter(conversation_id=conversation).aggregate(seq=Max("last_seq"))["seq"]
+        return max(stored or 0, archived or 0)
+
+    @database_sync_to_async
+    def backfill(self, group, entries):
+        """
+        Insert the hot window entries that never made it into ``Message``,
+        e.g. because the message writer shed them, before the window is
+        evicted. Returns how many were inserted.
+        """
+        conversation = conversation_id(group)
+        candidates = {
+            entry["seq"]: entry
+            for entry in entries
+            if {"seq", "user_id", "message", "timestamp"} <= entry.keys()
+        }
+        if conversation is None or not candidates:
+            return 0
+        low, high = min(candidates), max(candidates)
+        stored = set(
+            Message.objects.filter(conversation_id=conversation, seq__range=(low, high)).values_list("seq", flat=True)
+        )
+        blocks = MessageArchive.objects.filter(conversation_id=conversation, first_seq__lte=high, last_seq__gte=low)
+        for block in blocks:
+            stored.update(entry["seq"] for entry in unpack(block.data))
+        missing = [
+            Message(
+                conversation_id=conversation,
+                sender_id=entry["user_id"],
+                content=entry["message"],
+                timestamp=datetime.fromisoformat(entry["timestamp"]),
+                seq=seq,
+            )
+            for seq, entry in sorted(candidates.items())
+            if seq not in stored
+        ]
+        bulk_create_messages(missing)
+        return len(missing)
+
+
+def archive_messages(conversation, before, keep=500, block_size=1000):
+    """
+    Pack a conversation's messages older than ``before`` into compressed
+    ``MessageArchive`` blocks of up to ``block_size`` entries, and delete
+    the rows. The newest ``keep`` messages always stay in ``Message``.
+    Returns how many messages were archived.
+    """
+    rows = Message.objects.filter(conversation_id=conversation, seq__isnull=False)
+    boundary = rows.order_by("-seq").values_list("seq", flat=True)[keep:keep + 1]
+    if not boundary:
+        return 0
+    rows = rows.filter(seq__lte=boundary[0], timestamp__lt=before).select_related("sender").order_by("seq")
+    archived = 0
+    while True:
+        batch = list(rows[:block_size])
+        if not batch:
+            return archived
+        with transaction.atomic():
+            MessageArchive.objects.create(
+                conversation_id=conversation,
+                first_seq=batch[0].seq,
+                last_seq=batch[-1].seq,
+                count=len(batch),
+                data=pack([message_entry(message) for message in batch]),
+            )
+            Message.objects.filter(pk__in=[message.pk for message in batch]).delete()
+        archived += len(batch)
+
+
+def import_legacy_history(cache):
+    """
+    Move the JSON history blobs older releases kept in the Django cache
+    into ``Message``, then delete them. The blobs only carry the sender's
+    first name, so entries are attributed to the conversation participant
+    with that name; entries that match no single participant, and blobs of
+    rooms that are not persisted, are dropped. Imported rows get no
+    sequence number: they show up in the REST listing and search, not in
+    WebSocket history. ``cache`` has to support ``iter_keys``, as
+    django-redis does. Returns how many messages were imported and how
+    many were dropped.
+    """
+    imported = dropped = 0
+    prefix, suffix = LEGACY_HISTORY_KEY.split("{group}")
+    for key in cache.iter_keys(LEGACY_HISTORY_KEY.format(group="*")):
+        group = key[len(prefix):-len(suffix)]
+        try:
+            entries = json.loads(cache.get(key) or "[]")
+        except ValueError:
+            logger.warning("Dropping unreadable legacy history of %s", group)
+            entries = []
+        if not isinstance(entries, list):
+            entries = [entries]
+        messages = _legacy_messages(conversation_id(group), entries)
+        bulk_create_messages(messages)
+        cache.delete(key)
+        imported += len(messages)
+        dropped += len(entries) - len(messages)
+    return imported, dropped
+
+
+def _legacy_messages(conversation, entries):
+    if conversation is None:
+        return []
+    senders = {}
+    participants = ConversationParticipant.objects.filter(conversation_id=conversation).select_related("user")
+    for participant in participants:
+        name = participant.user.first_name
+        # A name two participants share cannot be attributed.
+        senders[name] = None if name in senders else participant.user_id
+    messages = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("message"), str):
+            continue
+        sender = senders.get(entry.get("user"))
+        if sender is None:
+            continue
+        try:
+            timestamp = datetime.fromisoformat(entry["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        messages.append(
+            Message(conversation_id=conversation, sender_id=sender, content=entry["message"], timestamp=timestamp)
+        )
+    return messages
@@ -1,222 +1,403 @@
-import json
+import asyncio
 import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.utils import timezone
 import logging
-from django.core.cache import cache
-from collections import defaultdict
+from . import encoding, metrics
+from .history import get_history_store
+from .log import log_event
+from .membership import get_membership_index
+from .outbound import RESYNC, OutboundQueue
+from .persistence import get_message_writer
+from .presence import get_presence_store
+from .ratelimit import get_rate_limiter
+from .receipts import get_read_receipts
+from .tasks import spawn
+from .typing_indicators import get_typing_tracker
 
 logger = logging.getLogger(__name__)
 
-class RateLimiter:
-    _limits = defaultdict(list)  
+SLOW_CONSUMER_CLOSE_CODE = 4008
+MAX_CLIENT_MSG_ID_LENGTH = 64
 
-    def __init__(self, max_per_second=1):
-        self.max_per_second = max_per_second
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-    async def allow(self, user_id):
-        now = time.time()
-        window_start = now - 1
-        timestamps = self._limits[user_id]
-        timestamps = [ts for ts in timestamps if ts > window_start]
-        self._limits[user_id] = timestamps
-        if len(timestamps) >= self.max_per_second:
-            return False
-        timestamps.append(now)
-        return True
 
-rate_limiter = RateLimiter(max_per_second=1)
+def _valid_client_msg_id(value):
+    return isinstance(value, str) and 0 < len(value) <= MAX_CLIENT_MSG_ID_LENGTH
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.group_name = f"chat_{self.conversation_id}"
+        self.joined = False
+        self.batch_window = None
+        offered = self.scope.get('subprotocols') or []
+        self.codec = encoding.negotiate(offered)
+        self.outbound = OutboundQueue(
+            max_size=settings.CHAT_SEND_QUEUE_SIZE,
+            grace=settings.CHAT_SLOW_CONSUMER_GRACE,
+            resync_frame=self.codec.encode({'type': RESYNC}),
+        )
+        self.writer = None
+        self.tasks = set()
+        user = self.scope["user"]
+        if not user.is_authenticated or not await get_membership_index().is_member(user.id, self.conversation_id):
+            log_event(logger, logging.INFO, "chat.refused", conversation=self.conversation_id,
+                      user=user.id if user.is_authenticated else None)
+            await self.close()
+            return
+        self.joined = True
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        await self.accept()
-        
+        await self.accept(self.codec.subprotocol if self.codec.subprotocol in offered else None)
+        metrics.connections.inc()
+        metrics.room_sizes.join(self.group_name)
+        self.writer = asyncio.get_running_loop().create_task(self.write_outbound())
+        await get_presence_store().touch(self.conversation_id, self.scope["user"].id, self.channel_name)
 
-        logger.info(f'User {self.scope["user"]} connected to {self.group_name}')
+        log_event(logger, logging.INFO, "chat.connected", conversation=self.conversation_id, user=self.scope["user"].id)
 
     async def disconnect(self, close_code):
+        if self.writer is not None:
+            self.writer.cancel()
+        if not self.joined:
+            return
+        metrics.connections.dec()
+        metrics.room_sizes.leave(self.group_name)
+        get_typing_tracker().stop_typing(self.group_name, self.scope["user"].id)
+        await get_presence_store().leave(self.conversation_id, self.scope["user"].id, self.channel_name)
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
-        logger.info(f'User {self.scope["user"]} disconnected from {self.group_name}')       
+        log_event(logger, logging.INFO, "chat.disconnected", conversation=self.conversation_id,
+                  user=self.scope["user"].id, close_code=close_code)
 
     async def receive(self, text_data=None, bytes_data=None):
-        data = json.loads(text_data)
+        if bytes_data is not None:
+            data = encoding.MsgPackCodec.decode(bytes_data)
+        else:
+            data = encoding.JSONCodec.decode(text_data)
         action = data.get('type')
-        if action == 'join': 
-            messages = await self.get_messages()   
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.join',
-                    'message': {
-                        'user': self.scope["user"].first_name,
-                        'user_id': self.scope["user"].id,
-                        'message': self.scope["user"].first_name + " joined the chat",
-                        'timestamp': timezone.now().isoformat()
-                    },
-                    'messages': json.dumps(messages)
-                }
-            )
-            logger.info(f'User {self.scope["user"]} joined the chat {self.group_name}')
-        elif action == 'message':
-            rate_limit_allowed = await rate_limiter.allow(self.scope['user'].id)
-            if not rate_limit_allowed:
+        label = metrics.action_label(action)
+        metrics.actions.labels(label).inc()
+        started = time.perf_counter()
+        await self.handle(action, data)
+        elapsed = time.perf_counter() - started
+        metrics.receive_seconds.labels(label).observe(elapsed)
+        log_event(logger, logging.INFO, "chat.action", action=label, conversation=self.conversation_id,
+                  user=self.scope["user"].id, latency_ms=round(elapsed * 1000, 3))
+
+    async def handle(self, action, data):
+        if action == 'message' and await self.ack_duplicate(data.get('client_msg_id')):
+            # A retry of a stored message gets its original ack even when
+            # the sender is over the rate limit.
+            return
+        allowed, retry_after = await get_rate_limiter().allow(action, self.scope['user'].id)
+        if not allowed:
+            metrics.rate_limited.labels(metrics.action_label(action)).inc()
+            if action == 'message':
                 message = {
                     'user': self.scope["user"].first_name,
                     'user_id': self.scope["user"].id,
                     'message': self.scope["user"].first_name + " has reached the rate limit" 
                 }
-                await self.send(text_data=json.dumps({
+                await self.reply({
                     'type': 'chat.message',
                     'user': self.scope["user"].first_name,
-                    'message': message
-                }))
-                logger.info(f'User {self.scope["user"]} is rate limited in {self.group_name}')
-                
-                return
+                    'message': message,
+                    'retry_after': retry_after
+                })
+            log_event(logger, logging.INFO, "chat.rate_limited", action=metrics.action_label(action),
+                      conversation=self.conversation_id, user=self.scope["user"].id, retry_after=retry_after)
+            return
+        if action == 'join': 
+            await self.broadcast({
+                'type': 'chat.join',
+                'message': {
+                    'user': self.scope["user"].first_name,
+                    'user_id': self.scope["user"].id,
+                    'message': self.scope["user"].first_name + " joined the chat",
+                    'timestamp': timezone.now().isoformat()
+                }
+            })
+            messages, next_cursor = await self.get_history_page()
+            await self.reply({
+                'type': 'chat.history',
+                'messages': messages,
+                'next_cursor': next_cursor
+            })
+        elif action == 'resume':
+            messages = await self.get_missed_messages(_to_int(data.get('last_seq')) or 0)
+            if messages is None:
+                # Too far behind to replay; the client reloads from the latest page.
+                messages, next_cursor = await self.get_history_page()
+                await self.reply({
+                    'type': 'chat.history',
+                    'messages': messages,
+                    'next_cursor': next_cursor,
+                    'reset': True
+                })
+            else:
+                await self.reply({
+                    'type': 'chat.resume',
+                    'messages': messages
+                })
+        elif action == 'message':
             message = data.get('content')
             if not message:
                 return
-            timestamp = timezone.now().isoformat()
+            client_msg_id = data.get('client_msg_id')
+            if client_msg_id is not None and not _valid_client_msg_id(client_msg_id):
+                return
+            writer = get_message_writer()
+            if self.persisted and writer.saturated:
+                # Refuse the message rather than broadcast one that would
+                # never be stored.
+                log_event(logger, logging.WARNING, "chat.write_backpressure", action='message',
+                          conversation=self.conversation_id, user=self.scope["user"].id)
+                await self.reply({
+                    'type': 'chat.message',
+                    'user': self.scope["user"].first_name,
+                    'message': {
+                        'user': self.scope["user"].first_name,
+                        'user_id': self.scope["user"].id,
+                        'message': "The server is busy, the message was not sent",
+                    },
+                    'retry_after': writer.flush_interval
+                })
+                return
+            timestamp = timezone.now()
             msg_obj = {
                 'user': self.scope["user"].first_name,
+                'user_id': self.scope["user"].id,
                 'message': message,
-                'timestamp': timestamp,
+                'timestamp': timestamp.isoformat(),
             }
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.message',
-                    'message': msg_obj
-                }
-            )
-            key = f'chat:{self.group_name}:messages'
-
-            await self.save_message(msg_obj)
-            logger.info(f'User {self.scope["user"]} sent message to {self.group_name}')
+            if client_msg_id is None:
+                msg_obj['seq'] = await self.save_message(msg_obj)
+            else:
+                msg_obj['client_msg_id'] = client_msg_id
+                with metrics.history_seconds.labels('append').time():
+                    msg_obj['seq'], created = await get_history_store().append_once(
+                        self.group_name, msg_obj, client_msg_id
+                    )
+                await self.reply({
+                    'type': 'chat.ack',
+                    'client_msg_id': client_msg_id,
+                    'seq': msg_obj['seq'],
+                    'duplicate': not created
+                })
+                if not created:
+                    return
+            get_typing_tracker().clear(self.group_name, self.scope["user"].id)
+            self.mark_read(msg_obj['seq'])
+            self.persist_message(message, timestamp, msg_obj['seq'])
+            await self.broadcast({
+                'type': 'chat.message',
+                'message': msg_obj
+            })
         elif action == 'typing':
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.typing',
-                    'user': self.scope["user"].first_name,
-                    'user_id': self.scope["user"].id
-                }
-            )
-            logger.info(f'User {self.scope["user"]} is typing in {self.group_name}')
+            get_typing_tracker().typing(self.group_name, self.scope["user"].id, self.scope["user"].first_name)
         elif action == 'stop_typing':
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.stop_typing',
-                    'user': self.scope["user"].first_name,
-                    'user_id': self.scope["user"].id
-                }
-            )
-            logger.info(f'User {self.scope["user"]} stopped typing in {self.group_name}')
+            get_typing_tracker().stop_typing(self.group_name, self.scope["user"].id)
         elif action == 'leave':
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.leave',
-                    'user': self.scope["user"].first_name,
-                    'user_id': self.scope["user"].id
-                }
-            )
+            await self.broadcast({
+                'type': 'chat.leave',
+                'user': self.scope["user"].first_name,
+                'user_id': self.scope["user"].id
+            })
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
-            logger.info(f'User {self.scope["user"]} left the chat {self.group_name}')
         elif action == 'history':
-
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'chat.history',
-                    'messages': json.dumps(await self.get_messages())
-                }
+            messages, next_cursor = await self.get_history_page(
+                before=data.get('before'),
+                after=data.get('after'),
+                limit=data.get('limit'),
             )
-            logger.info(f'User {self.scope["user"]} requested history for {self.group_name}')
+            await self.reply({
+                'type': 'chat.history',
+                'messages': messages,
+                'next_cursor': next_cursor
+            })
+        elif action == 'read':
+            seq = _to_int(data.get('seq'))
+            if seq is None or seq <= 0:
+                return
+            # A watermark never runs ahead of the newest message.
+            seq = min(seq, await get_history_store().last_seq(self.group_name))
+            if seq > 0:
+                self.mark_read(seq)
+        elif action == 'ping':
+            await get_presence_store().touch(self.conversation_id, self.scope["user"].id, self.channel_name)
+            await self.reply({'type': 'chat.pong'})
+        elif action == 'presence':
+            requested = data.get('conversation_ids') or [self.conversation_id]
+            if not isinstance(requested, list):
+                return
+            member_of = await get_membership_index().conversations(self.scope["user"].id)
+            conversation_ids = [
+                str(conversation_id)
+                for conversation_id in requested
+                if _to_int(conversation_id) in member_of
+            ]
+            online = await get_presence_store().online(conversation_ids[:settings.CHAT_PRESENCE_MAX_QUERY])
+            await self.reply({
+                'type': 'chat.presence',
+                'online': online
+            })
+        elif action == 'batch':
+            window_ms = _to_int(data.get('window_ms'))
+            if data.get('enabled', True) and window_ms:
+                self.batch_window = min(max(window_ms, 1), settings.CHAT_BATCH_MAX_WINDOW_MS) / 1000
+            else:
+                self.batch_window = None
+            await self.reply({
+                'type': 'chat.batch_settings',
+                'window_ms': round(self.batch_window * 1000) if self.batch_window else None
+            })
         else:
             return
-            
-
-    async def chat_join(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.join',
-            'message': event['message'],
-            'messages': event['messages']
-        }))
-
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.message',
-            'message': event['message'],
-        }))
-
-    async def chat_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.typing',
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))       
-
-    async def chat_stop_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.stop_typing',
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))
-
-    async def chat_leave(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.leave',
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))
-
-    async def chat_history(self, event):
-
-        await self.send(text_data=json.dumps({
-            'type': 'chat.history',
-            'messages': event['messages']
-        }))
-
-    # @database_sync_to_async
-    async def get_messages(self):
-
-        messages = cache.get(f"chat:{self.group_name}:messages")
-
-        if messages is None :
-            return []
-        messages = json.loads(messages)
-
-        if not isinstance(messages, list):
-            return [messages]
+
+    async def broadcast(self, payload):
+        """
+        Encode ``payload`` once per wire format and fan the finished frames
+        out to the room.
+
+        The channel layer carries the encoded frames as-is, so each recipient
+        only forwards the one its socket speaks instead of re-serializing the
+        same event.
+        """
+        await self.channel_layer.group_send(self.group_name, encoding.event(payload))
+
+    async def forward_frame(self, event):
+        metrics.delivery_seconds.observe(time.time() - event['sent_at'])
+        self.enqueue(event['type'], event[self.codec.field])
+
+    async def reply(self, payload):
+        self.enqueue(payload['type'], self.codec.encode(payload))
+
+    def enqueue(self, kind, text):
+        """
+        Queue a frame for this socket without waiting for it to be written,
+        so a slow client never holds up the channel layer.
+        """
+        if self.outbound.put(kind, text):
+            metrics.slow_consumer_disconnects.inc()
+            log_event(logger, logging.WARNING, "chat.slow_consumer", conversation=self.conversation_id,
+                      user=self.scope["user"].id, queued=len(self.outbound))
+            spawn(self.close(code=SLOW_CONSUMER_CLOSE_CODE), self.tasks)
+
+    async def write_outbound(self):
+        """
+        Write queued frames in order. With batching enabled, frames that
+        arrive within the batch window go out as ``chat.batch`` frames of up
+        to ``CHAT_BATCH_MAX_EVENTS`` events. A full batch goes out without
+        waiting for the window, and a backlog is drained without waiting
+        again, so no frame waits more than one window.
+        """
+        while True:
+            await self.outbound.wait()
+            if self.batch_window is None:
+                await self.write_frames(self.outbound.pop(1))
+                continue
+            if len(self.outbound) < settings.CHAT_BATCH_MAX_EVENTS:
+                await asyncio.sleep(self.batch_window)
+            while len(self.outbound):
+                await self.write_frames(self.outbound.pop(settings.CHAT_BATCH_MAX_EVENTS))
+
+    async def write_frames(self, frames):
+        if len(frames) > 1:
+            frames = [self.codec.batch(frames)]
+        if frames:
+            await self.send(**{f'{self.codec.field}_data': frames[0]})
+
+    chat_join = chat_message = chat_typing = chat_leave = chat_read = forward_frame
+
+    async def get_missed_messages(self, last_seq):
+        """
+        Return the messages after ``last_seq``, or None if some of them have
+        already been trimmed from history or there are too many to replay.
+        """
+        limit = settings.CHAT_RESUME_MAX_MESSAGES
+        with metrics.history_seconds.labels('read').time():
+            messages = await get_history_store().after(self.group_name, last_seq, limit + 1)
+        if len(messages) > limit or (messages and messages[0]['seq'] != last_seq + 1):
+            return None
         return messages
 
-    # @database_sync_to_async
+    async def get_history_page(self, before=None, after=None, limit=None):
+        """
+        Return one page of history and the cursor for the following page.
+
+        With ``after`` the page walks forward from that sequence number,
+        otherwise it walks back from ``before`` (or from the newest message).
+        """
+        limit = _to_int(limit) or settings.CHAT_HISTORY_PAGE_SIZE
+        limit = min(max(limit, 1), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+        store = get_history_store()
+        after, before = _to_int(after), _to_int(before)
+        with metrics.history_seconds.labels('read').time():
+            if after is not None:
+                messages = await store.after(self.group_name, after, limit)
+            elif before is None:
+                messages = await store.latest(self.group_name, limit)
+            else:
+                messages = await store.before(self.group_name, before, limit)
+        if after is not None:
+            next_cursor = messages[-1]['seq'] if len(messages) == limit else None
+        else:
+            next_cursor = messages[0]['seq'] if messages and messages[0]['seq'] > 1 else None
+        return messages, next_cursor
+
     async def save_message(self, content):
+        with metrics.history_seconds.labels('append').time():
+            return await get_history_store().append(self.group_name, content)
 
-        existing_messages = await self.get_messages()
+    def mark_read(self, seq):
+        if self.conversation_id.isdigit():
+            get_read_receipts().ack(self.scope["user"].id, self.conversation_id, self.group_name, seq)
 
-        if existing_messages:
-            existing_messages.append(content)
-        else:
-            existing_messages = [content]
-        
-        cache.set(f"chat:{self.group_name}:messages", json.dumps(existing_messages))
-        return existing_messages
+    async def ack_duplicate(self, client_msg_id):
+        """
+        Re-send the ack of a message the client already got stored, and
+        return whether ``client_msg_id`` was such a retry.
+        """
+        if not _valid_client_msg_id(client_msg_id):
+            return False
+        seq = await get_history_store().client_msg_seq(self.group_name, client_msg_id)
+        if seq is None:
+            return False
+        await self.reply({
+            'type': 'chat.ack',
+            'client_msg_id': client_msg_id,
+            'seq': seq,
+            'duplicate': True
+        })
+        return True
 
+    @property
+    def persisted(self):
+        return self.scope["user"].is_authenticated and self.conversation_id.isdigit()
 
-        
\ No newline at end of file
+    def persist_message(self, content, timestamp, seq):
+        if not self.persisted:
+            return
+        get_message_writer().enqueue(
+            conversation_id=int(self.conversation_id),
+            sender_id=self.scope["user"].id,
+            content=content,
+            timestamp=timestamp,
+            seq=seq,
+        )
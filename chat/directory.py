@@ -0,0 +1,30 @@
+import hashlib
+from django.core.cache import cache
+
+VERSION_KEY = "chat:directory:version"
+
+
+def directory_version():
+    """
+    Return a counter that changes whenever the user directory does.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_directory_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def directory_etag(request, *args, **kwargs):
+    """
+    ETag of one directory page: the directory version plus the page's query.
+    """
+    key = f"{directory_version()}:{request.GET.urlencode()}"
+    return hashlib.sha1(key.encode()).hexdigest()
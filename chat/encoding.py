@@ -0,0 +1,93 @@
+import json
+import time
+import msgpack
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def dumps(obj):
+    """
+    Encode ``obj`` as a JSON text frame, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONCodec:
+    """
+    The default wire format: one JSON object per text frame.
+    """
+
+    subprotocol = "chat.json"
+    field = "text"
+
+    encode = staticmethod(dumps)
+    decode = staticmethod(loads)
+
+    @staticmethod
+    def batch(frames):
+        # The events are already encoded, so splice them in as-is.
+        return '{"type":"chat.batch","events":[' + ','.join(frames) + ']}'
+
+
+class MsgPackCodec:
+    """
+    The same events as MessagePack maps in binary frames.
+    """
+
+    subprotocol = "chat.msgpack"
+    field = "bytes"
+
+    @staticmethod
+    def encode(obj):
+        return msgpack.packb(obj)
+
+    @staticmethod
+    def decode(data):
+        return msgpack.unpackb(data)
+
+    @staticmethod
+    def batch(frames):
+        packer = msgpack.Packer()
+        return b"".join([
+            packer.pack_map_header(2),
+            packer.pack("type"),
+            packer.pack("chat.batch"),
+            packer.pack("events"),
+            packer.pack_array_header(len(frames)),
+            *frames,
+        ])
+
+
+CODECS = {codec.subprotocol: codec for codec in (JSONCodec, MsgPackCodec)}
+
+
+def negotiate(subprotocols):
+    """
+    Pick the first codec the client offered in ``Sec-WebSocket-Protocol``,
+    falling back to JSON.
+    """
+    for subprotocol in subprotocols or ():
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return JSONCodec
+
+
+def event(payload):
+    """
+    Build a channel layer event carrying ``payload`` pre-encoded in every
+    wire format, so each recipient forwards the field its socket speaks.
+    ``sent_at`` lets recipients measure delivery latency.
+    """
+    frames = {codec.field: codec.encode(payload) for codec in CODECS.values()}
+    return {"type": payload["type"], "sent_at": time.time(), **frames}
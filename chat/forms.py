@@ -26,7 +26,7 @@ class SignUpForm(UserCreationForm):
         user.set_password(self.cleaned_data["password1"])
         if commit:
             user.save()
-            logger.info("SignUpForm user saved", user)
+            logger.info("SignUpForm user saved", extra={"user": user.id})
         return user
 
 
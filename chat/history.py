@@ -0,0 +1,399 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .redis_client import Script, get_redis
+
+
+# Assigns the next sequence number of a room and appends the entry, then
+# trims the list and refreshes the room's expiry. If the counter is gone
+# (a new room, or one evicted from Redis) it is seeded from ARGV[4]; a
+# negative seed means the caller has to look it up first, and gets 0 back.
+# The entry is a JSON object; the assigned sequence number is spliced in
+# as its first key so the payload never has to be decoded on the server.
+_APPEND = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if tonumber(ARGV[4]) < 0 then
+        return 0
+    end
+    redis.call('SET', KEYS[2], ARGV[4])
+end
+local seq = redis.call('INCR', KEYS[2])
+local entry = '{"seq":' .. seq .. ',' .. string.sub(ARGV[1], 2)
+redis.call('RPUSH', KEYS[1], entry)
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+"""
+
+# Appends one entry in a single atomic step, so two workers writing the
+# same room can never lose each other's messages.
+APPEND_SCRIPT = Script(_APPEND + """
+return seq
+""")
+
+# Same as APPEND_SCRIPT, but remembers the sequence number assigned to a
+# client-supplied message id for ARGV[5] seconds. A retry of the same id
+# returns the original number instead of appending again.
+APPEND_ONCE_SCRIPT = Script("""
+local seen = redis.call('GET', KEYS[3])
+if seen then
+    return {tonumber(seen), 0}
+end
+""" + _APPEND.replace("return 0", "return {0, 0}") + """
+redis.call('SET', KEYS[3], seq, 'EX', ARGV[5])
+return {seq, 1}
+""")
+
+# Returns the first sequence number still in the window, followed by the
+# entries whose sequence numbers fall in [ARGV[1], ARGV[2]], or just 0 if
+# the room has no counter. The list always holds a contiguous run of
+# sequence numbers ending at the room counter, so the bounds translate
+# directly into list indexes.
+RANGE_SCRIPT = Script("""
+local last = redis.call('GET', KEYS[2])
+if not last then
+    return {0}
+end
+last = tonumber(last)
+local first = last - redis.call('LLEN', KEYS[1]) + 1
+local lo = math.max(tonumber(ARGV[1]), first)
+local hi = math.min(tonumber(ARGV[2]), last)
+local result = {first}
+if hi >= lo then
+    for _, entry in ipairs(redis.call('LRANGE', KEYS[1], lo - first, hi - first)) do
+        table.insert(result, entry)
+    end
+end
+return result
+""")
+
+# Deletes a room's window and counter, unless something was appended since
+# its counter read ARGV[1].
+EVICT_SCRIPT = Script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+""")
+
+
+class BaseHistoryStore:
+    """
+    Append-only, capped message history per room.
+
+    Every entry gets a per-room monotonic ``seq`` on append. Reads are by
+    position (``range``/``latest``) or by sequence number (``between``,
+    ``before``, ``after``).
+
+    ``append_once`` deduplicates retries by a client-supplied message id,
+    which is remembered for ``dedupe_ttl`` seconds.
+
+    The store is the hot tier: it keeps the last ``max_length`` entries of
+    a room, and a room with no new message for ``max_age`` seconds drops
+    out of it entirely. With an ``archive`` (a dotted path to a class like
+    ``chat.archive.ArchivedHistory``), reads reaching past the window are
+    filled in from it, and a room's counter resumes from the archive once
+    the room is back.
+    """
+
+    def __init__(self, max_length=500, dedupe_ttl=300, max_age=None, archive=None):
+        self.max_length = max_length
+        self.dedupe_ttl = dedupe_ttl
+        self.max_age = max_age
+        self.archive = import_string(archive)() if isinstance(archive, str) else archive
+
+    async def append(self, group, entry):
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide an append() method")
+
+    async def append_once(self, group, entry, client_msg_id):
+        """
+        Append ``entry`` unless ``client_msg_id`` was already used in this
+        room. Returns ``(seq, created)``; for a duplicate, ``seq`` is the one
+        assigned to the original message.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide an append_once() method")
+
+    async def client_msg_seq(self, group, client_msg_id):
+        """
+        Return the sequence number assigned to ``client_msg_id`` in this
+        room, or None if it has not been used within ``dedupe_ttl``.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide a client_msg_seq() method")
+
+    async def range(self, group, start=0, stop=-1):
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide a range() method")
+
+    async def window(self, group, low, high):
+        """
+        Return the first sequence number in the room's window (None if the
+        room is not in the store) and the window's entries in [low, high].
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide a window() method")
+
+    async def snapshot(self, group):
+        """
+        Return the room's counter and every entry in its window.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide a snapshot() method")
+
+    def idle_rooms(self, min_idle):
+        """
+        Yield, asynchronously, the rooms with no new message for at least
+        ``min_idle`` seconds.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide an idle_rooms() method")
+
+    async def evict(self, group, last_seq):
+        """
+        Drop the room's window and counter, unless its counter has moved
+        past ``last_seq``. Returns whether the room was evicted.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide an evict() method")
+
+    async def last_seq(self, group):
+        """
+        Return the sequence number of the room's newest message.
+        """
+        raise NotImplementedError("subclasses of BaseHistoryStore must provide a last_seq() method")
+
+    async def seed(self, group):
+        """
+        Return where a room's counter starts when it is not in the store.
+        """
+        return await self.archive.last_seq(group) if self.archive is not None else 0
+
+    async def between(self, group, low, high):
+        first, entries = await self.window(group, low, high)
+        if self.archive is None or (first is not None and low >= first):
+            return entries
+        older = await self.archive.between(group, low, high if first is None else min(high, first - 1))
+        return older + entries
+
+    async def latest(self, group, limit=None):
+        if limit is None:
+            return await self.range(group)
+        if limit <= 0:
+            return []
+        entries = await self.range(group, -limit, -1)
+        if self.archive is None or len(entries) == limit or (entries and entries[0]["seq"] == 1):
+            return entries
+        if not entries:
+            return await self.archive.latest(group, limit)
+        first = entries[0]["seq"]
+        return await self.archive.between(group, max(first - limit + len(entries), 1), first - 1) + entries
+
+    async def before(self, group, seq, limit):
+        if limit <= 0 or seq <= 1:
+            return []
+        return await self.between(group, max(seq - limit, 1), seq - 1)
+
+    async def after(self, group, seq, limit):
+        if limit <= 0:
+            return []
+        return await self.between(group, seq + 1, seq + limit)
+
+
+class RedisHistoryStore(BaseHistoryStore):
+    """
+    History kept in a Redis list per room next to a sequence counter. Both
+    keys expire ``max_age`` seconds after the room's last message.
+    """
+
+    def __init__(self, max_length=500, dedupe_ttl=300, max_age=None, archive=None, prefix="chat"):
+        super().__init__(max_length=max_length, dedupe_ttl=dedupe_ttl, max_age=max_age, archive=archive)
+        self.prefix = prefix
+
+    def messages_key(self, group):
+        return f"{self.prefix}:{group}:messages"
+
+    def seq_key(self, group):
+        return f"{self.prefix}:{group}:seq"
+
+    def client_msg_key(self, group, client_msg_id):
+        # Hashed so a client-chosen id can never form another key's suffix,
+        # such as the ``:seq`` that ``idle_rooms`` scans for.
+        digest = hashlib.sha1(client_msg_id.encode()).hexdigest()
+        return f"{self.prefix}:{group}:client:{digest}"
+
+    async def append(self, group, entry):
+        keys = [self.messages_key(group), self.seq_key(group)]
+        args = [json.dumps(entry), self.max_length, self.max_age or 0]
+        # Only look the counter up in the archive when Redis lost it.
+        seq = await APPEND_SCRIPT(get_redis(), keys=keys, args=[*args, -1 if self.archive else 0])
+        if not seq:
+            seq = await APPEND_SCRIPT(get_redis(), keys=keys, args=[*args, await self.seed(group)])
+        return seq
+
+    async def append_once(self, group, entry, client_msg_id):
+        keys = [self.messages_key(group), self.seq_key(group), self.client_msg_key(group, client_msg_id)]
+        args = [json.dumps(entry), self.max_length, self.max_age or 0]
+        seq, created = await APPEND_ONCE_SCRIPT(
+            get_redis(), keys=keys, args=[*args, -1 if self.archive else 0, self.dedupe_ttl],
+        )
+        if not seq:
+            seq, created = await APPEND_ONCE_SCRIPT(
+                get_redis(), keys=keys, args=[*args, await self.seed(group), self.dedupe_ttl],
+            )
+        return seq, bool(created)
+
+    async def client_msg_seq(self, group, client_msg_id):
+        seq = await get_redis().get(self.client_msg_key(group, client_msg_id))
+        return int(seq) if seq is not None else None
+
+    async def last_seq(self, group):
+        last = await get_redis().get(self.seq_key(group))
+        return int(last) if last is not None else await self.seed(group)
+
+    async def range(self, group, start=0, stop=-1):
+        raw_entries = await get_redis().lrange(self.messages_key(group), start, stop)
+        return [json.loads(raw) for raw in raw_entries]
+
+    async def window(self, group, low, high):
+        first, *raw_entries = await RANGE_SCRIPT(
+            get_redis(),
+            keys=[self.messages_key(group), self.seq_key(group)],
+            args=[low, high],
+        )
+        return first or None, [json.loads(raw) for raw in raw_entries]
+
+    async def snapshot(self, group):
+        async with get_redis().pipeline(transaction=True) as pipe:
+            last, raw_entries = await pipe.get(self.seq_key(group)).lrange(self.messages_key(group), 0, -1).execute()
+        return int(last or 0), [json.loads(raw) for raw in raw_entries]
+
+    async def idle_rooms(self, min_idle):
+        redis = get_redis()
+        head, tail = len(self.prefix) + 1, -len(":seq")
+        async for key in redis.scan_iter(match=self.seq_key("*"), count=1000):
+            ttl = await redis.ttl(key)
+            if self.max_age and ttl >= 0:
+                idle = self.max_age - ttl
+            else:
+                # Counters written before max_age was set never expire.
+                idle = await redis.object("idletime", key)
+            if idle is not None and idle >= min_idle:
+                yield key.decode()[head:tail]
+
+    async def evict(self, group, last_seq):
+        return bool(await EVICT_SCRIPT(
+            get_redis(),
+            keys=[self.messages_key(group), self.seq_key(group)],
+            args=[last_seq],
+        ))
+
+
+class InMemoryHistoryStore(BaseHistoryStore):
+    """
+    Process-local history, for tests and single-process development.
+    Rooms never expire on their own; ``max_age`` only feeds ``idle_rooms``.
+    """
+
+    def __init__(self, max_length=500, dedupe_ttl=300, max_age=None, archive=None):
+        super().__init__(max_length=max_length, dedupe_ttl=dedupe_ttl, max_age=max_age, archive=archive)
+        self._entries = {}
+        self._seq = {}
+        self._appended_at = {}
+        # (group, client_msg_id) -> (seq, expires_at), oldest first.
+        self._client_msg_ids = {}
+
+    async def append(self, group, entry):
+        if group not in self._seq:
+            seed = await self.seed(group)
+            self._seq.setdefault(group, seed)
+        seq = self._seq[group] + 1
+        self._seq[group] = seq
+        self._appended_at[group] = time.monotonic()
+        entries = self._entries.setdefault(group, [])
+        entries.append({"seq": seq, **entry})
+        del entries[:-self.max_length]
+        return seq
+
+    async def append_once(self, group, entry, client_msg_id):
+        seen = await self.client_msg_seq(group, client_msg_id)
+        if seen is not None:
+            return seen, False
+        seq = await self.append(group, entry)
+        self._client_msg_ids[(group, client_msg_id)] = (seq, time.monotonic() + self.dedupe_ttl)
+        return seq, True
+
+    async def client_msg_seq(self, group, client_msg_id):
+        now = time.monotonic()
+        while self._client_msg_ids:
+            key, (_, expires_at) = next(iter(self._client_msg_ids.items()))
+            if expires_at > now:
+                break
+            del self._client_msg_ids[key]
+        seen = self._client_msg_ids.get((group, client_msg_id))
+        return seen[0] if seen is not None else None
+
+    async def last_seq(self, group):
+        return self._seq[group] if group in self._seq else await self.seed(group)
+
+    async def range(self, group, start=0, stop=-1):
+        entries = self._entries.get(group, [])
+        # Match LRANGE: ``stop`` is inclusive.
+        stop = len(entries) if stop == -1 else stop + 1
+        return list(entries[start:stop])
+
+    async def window(self, group, low, high):
+        if group not in self._seq:
+            return None, []
+        entries = self._entries.get(group, [])
+        first = entries[0]["seq"] if entries else self._seq[group] + 1
+        low = max(low, first)
+        high = min(high, self._seq[group])
+        if high < low:
+            return first, []
+        return first, list(entries[low - first:high - first + 1])
+
+    async def snapshot(self, group):
+        return self._seq.get(group, 0), list(self._entries.get(group, []))
+
+    async def idle_rooms(self, min_idle):
+        now = time.monotonic()
+        for group, appended_at in list(self._appended_at.items()):
+            if now - appended_at >= min_idle:
+                yield group
+
+    async def evict(self, group, last_seq):
+        if self._seq.get(group) != last_seq:
+            return False
+        self._entries.pop(group, None)
+        self._seq.pop(group, None)
+        self._appended_at.pop(group, None)
+        return True
+
+    def flush(self):
+        self._entries.clear()
+        self._seq.clear()
+        self._appended_at.clear()
+        self._client_msg_ids.clear()
+
+
+_store = None
+
+
+def get_history_store():
+    """
+    Return the process-wide history store configured by ``CHAT_HISTORY``.
+    """
+    global _store
+    if _store is None:
+        config = getattr(settings, "CHAT_HISTORY", {})
+        backend = import_string(config.get("BACKEND", "chat.history.RedisHistoryStore"))
+        _store = backend(**config.get("CONFIG", {}))
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_history_store(setting, **kwargs):
+    global _store
+    if setting == "CHAT_HISTORY":
+        _store = None
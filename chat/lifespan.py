@@ -0,0 +1,32 @@
+import logging
+from .persistence import get_message_writer
+from .receipts import get_read_receipts
+
+logger = logging.getLogger(__name__)
+
+
+async def drain():
+    """
+    Write out everything the background writers still hold in memory:
+    accepted messages first, then read watermarks.
+    """
+    for writer in (get_message_writer(), get_read_receipts()):
+        try:
+            await writer.stop()
+        except Exception:
+            logger.exception("Draining %s on shutdown failed", type(writer).__name__)
+
+
+async def lifespan(scope, receive, send):
+    """
+    ASGI lifespan handler. The server sends ``lifespan.shutdown`` after it
+    has closed its connections, so nothing is enqueued once ``drain`` runs.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await drain()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,74 @@
+import atexit
+import logging
+import queue
+import random
+from logging.handlers import QueueListener
+from django.conf import settings
+
+
+class _Listener(QueueListener):
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing to stop when the queue is full.
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(logging.Handler):
+    """
+    Hands records to a background thread that formats and writes them, so
+    logging never blocks the event loop on I/O or JSON encoding.
+
+    The formatter configured on this handler is used by the writer thread.
+    When the queue is full, records are dropped and counted in ``dropped``
+    rather than stalling the caller.
+
+    This is deliberately not a ``QueueHandler`` subclass: from Python 3.12
+    ``dictConfig`` configures those itself and rejects this handler's
+    arguments.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__()
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream)
+        self.listener = _Listener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        # Unlike QueueHandler, don't format on the caller's thread: the
+        # queue stays in process, so the writer thread does that work.
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def log_event(logger, level, event, action=None, **fields):
+    """
+    Log a structured event, e.g. ``log_event(logger, logging.INFO,
+    "chat.action", action="message", conversation="12", user=3)``.
+
+    Events whose ``action`` has a rate in ``CHAT_LOG_SAMPLING`` are kept with
+    that probability, and the rate is recorded on the ones that are kept.
+    Level and sampling are checked before any record is built, so dropped
+    events cost next to nothing.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = settings.CHAT_LOG_SAMPLING.get(action, 1.0)
+    if rate < 1.0:
+        if random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+    if action is not None:
+        fields["action"] = action
+    logger.log(level, event, extra=fields)
@@ -0,0 +1,143 @@
+import json
+import statistics
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from chat.models import Conversation, ConversationParticipant, Message
+from chat.search import SEARCH_CONFIG
+from chat.views import search_messages
+
+User = get_user_model()
+
+BENCH_EMAIL = "bench-search@example.com"
+COMMON_WORDS = [
+    "deploy", "release", "meeting", "lunch", "review", "bug", "ticket", "customer",
+    "server", "database", "today", "tomorrow", "please", "thanks", "update", "design",
+]
+# Skewed so a few words are very common and most are rare, like real chat.
+INSERT_SQL = f"""
+INSERT INTO chat_message (conversation_id, sender_id, content, timestamp, seq, search_vector)
+SELECT
+    conversation_ids[1 + mod(g, array_length(conversation_ids, 1))],
+    %(user_id)s,
+    content,
+    now() - g * interval '1 second',
+    g,
+    to_tsvector('{SEARCH_CONFIG}', content)
+FROM
+    (SELECT %(conversation_ids)s::int[] AS conversation_ids, %(words)s::text[] AS words) AS params,
+    LATERAL (
+        SELECT g, (
+            -- Referencing g makes this run once per row instead of once.
+            SELECT string_agg(words[1 + floor(power(random(), 3) * array_length(words, 1))::int], ' ')
+            FROM generate_series(1, %(words_per_message)s)
+            WHERE g > 0
+        ) AS content
+        FROM generate_series(%(start)s, %(stop)s) AS g
+    ) AS generated
+"""
+
+
+class Command(BaseCommand):
+    help = "Load synthetic messages into Postgres and time the message search API."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--conversations", type=int, default=200)
+        parser.add_argument("--vocabulary", type=int, default=20_000)
+        parser.add_argument("--words-per-message", type=int, default=12)
+        parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query.")
+        parser.add_argument("--pages", type=int, default=5, help="Pages to follow for the deep-page timing.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated data for another run.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("bench_search needs a Postgres database.")
+        user, conversations = self.load(options)
+        try:
+            self.time_queries(user, options)
+        finally:
+            if not options["keep"]:
+                self.clean_up(user, conversations)
+
+    def load(self, options):
+        user, created = User.objects.get_or_create(
+            username=BENCH_EMAIL, defaults={"email": BENCH_EMAIL, "first_name": "bench"}
+        )
+        conversations = list(Conversation.objects.filter(owner=user).values_list("id", flat=True))
+        if not created and Message.objects.filter(conversation_id__in=conversations).exists():
+            self.stdout.write("Reusing existing benchmark data.")
+            return user, conversations
+
+        conversations = [
+            conversation.id for conversation in Conversation.objects.bulk_create(
+                [Conversation(owner=user, title=f"bench {i}") for i in range(options["conversations"])]
+            )
+        ]
+        # The user belongs to half of the rooms so results have to be scoped.
+        ConversationParticipant.objects.bulk_create(
+            [ConversationParticipant(conversation_id=cid, user=user) for cid in conversations[::2]]
+        )
+        words = COMMON_WORDS + [f"term{i}" for i in range(options["vocabulary"])]
+        chunk = 100_000
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            for start in range(1, options["messages"] + 1, chunk):
+                cursor.execute(INSERT_SQL, {
+                    "user_id": user.id,
+                    "words_per_message": options["words_per_message"],
+                    "start": start,
+                    "stop": min(start + chunk - 1, options["messages"]),
+                    "conversation_ids": conversations,
+                    "words": words,
+                })
+                self.stdout.write(f"  inserted {min(start + chunk - 1, options['messages']):,} messages")
+            cursor.execute("ANALYZE chat_message")
+        self.stdout.write(f"Loaded {options['messages']:,} messages in {time.perf_counter() - started:.1f}s")
+        return user, conversations
+
+    def time_queries(self, user, options):
+        factory = RequestFactory()
+        vocabulary = options["vocabulary"]
+        queries = {
+            "common word": COMMON_WORDS[0],
+            "mid-frequency word": f"term{vocabulary // 10}",
+            "rare word": f"term{vocabulary - 1}",
+            "two words": f"{COMMON_WORDS[1]} term{vocabulary // 10}",
+            "phrase": f'"{COMMON_WORDS[0]} {COMMON_WORDS[1]}"',
+        }
+
+        def fetch(params):
+            request = factory.get("/api/search/", params)
+            request.user = user
+            started = time.perf_counter()
+            response = search_messages(request)
+            return (time.perf_counter() - started) * 1000, response
+
+        self.stdout.write(f"{'query':<20} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'deep p50':>9}")
+        for label, text in queries.items():
+            fetch({"q": text})  # warm the cache
+            first_page = sorted(fetch({"q": text})[0] for _ in range(options["repeat"]))
+
+            cursor, deep_page = None, []
+            for _ in range(options["pages"]):
+                elapsed, response = fetch({"q": text, **({"cursor": cursor} if cursor else {})})
+                deep_page.append(elapsed)
+                cursor = json.loads(response.content)["next_cursor"] if response.status_code == 200 else None
+                if cursor is None:
+                    break
+
+            p95 = first_page[min(len(first_page) - 1, int(len(first_page) * 0.95))]
+            self.stdout.write(
+                f"{label:<20} {statistics.median(first_page):>8.1f} {p95:>8.1f} "
+                f"{first_page[-1]:>8.1f} {statistics.median(deep_page):>9.1f}"
+            )
+
+    def clean_up(self, user, conversations):
+        # Raw delete: going through the ORM would load every message first.
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM chat_message WHERE conversation_id = ANY(%s)", [conversations])
+        Conversation.objects.filter(id__in=conversations).delete()
+        user.delete()
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+import msgpack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from chat.membership import get_membership_index
+from chat.routing import websocket_urlpatterns
+
+LAYERS = {
+    "memory": lambda options: {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 100_000},
+    },
+    "redis": lambda options: {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [(options["redis_host"], 6379)], "capacity": 100_000},
+    },
+    "redis-pubsub": lambda options: {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {"hosts": [(options["redis_host"], 6379)]},
+    },
+}
+
+# Everything but the channel layer stays in process offline; against Redis
+# the history and presence stores use it too, as in production.
+IN_MEMORY_STORES = {
+    "CHAT_HISTORY": {"BACKEND": "chat.history.InMemoryHistoryStore"},
+    "CHAT_PRESENCE": {"BACKEND": "chat.presence.InMemoryPresenceStore"},
+}
+COMMON_OVERRIDES = {
+    # Load generators would only measure the limiter.
+    "CHAT_RATE_LIMITER": {"BACKEND": "chat.ratelimit.InMemoryRateLimiter", "CONFIG": {"limits": {}}},
+    "CHAT_MEMBERSHIP": {"BACKEND": "chat.membership.InMemoryMembershipIndex"},
+}
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else None
+        return {"p50": value, "p95": value, "p99": value, "max": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(samples)}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ("message", "typing", "join"):
+            raise CommandError(f"Unknown action in --mix: {action!r}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """
+    One simulated socket: sends actions and records what it receives.
+    """
+
+    def __init__(self, application, room, user_id, protocol):
+        self.room = room
+        self.user_id = user_id
+        self.protocol = protocol
+        subprotocols = ["chat.msgpack"] if protocol == "msgpack" else None
+        self.communicator = WebsocketCommunicator(application, f"/ws/chat/{room}/", subprotocols=subprotocols)
+        self.communicator.scope["user"] = SimpleNamespace(
+            id=user_id, first_name=f"user{user_id}", is_authenticated=True
+        )
+        self.received = {}
+        self.latencies = []
+
+    async def connect(self):
+        get_membership_index().set(self.user_id, [self.room])
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError(f"Client {self.user_id} could not join room {self.room}")
+
+    async def send(self, payload):
+        if self.protocol == "msgpack":
+            await self.communicator.send_to(bytes_data=msgpack.packb(payload))
+        else:
+            await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def read(self):
+        while True:
+            frame = await self.communicator.receive_output(timeout=3600)
+            if frame["type"] != "websocket.send":
+                return
+            now = time.perf_counter_ns()
+            data = msgpack.unpackb(frame["bytes"]) if "bytes" in frame else json.loads(frame["text"])
+            for event in data["events"] if data["type"] == "chat.batch" else [data]:
+                self.received[event["type"]] = self.received.get(event["type"], 0) + 1
+                if event["type"] == "chat.message":
+                    self.latencies.append((now - int(event["message"]["message"])) / 1e6)
+
+
+class Command(BaseCommand):
+    help = "Simulate many WebSocket clients against ChatConsumer and report fan-out latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layer", choices=sorted(LAYERS), default="memory")
+        parser.add_argument("--redis-host", default="127.0.0.1")
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--members", type=int, default=100, help="Clients per room.")
+        parser.add_argument("--actions", type=int, default=200, help="Actions sent per room.")
+        parser.add_argument("--mix", type=parse_mix, default="message=8,typing=2",
+                            help="Relative weights of message, typing and join actions.")
+        parser.add_argument("--rate", type=float, default=0,
+                            help="Actions per second per room; 0 sends as fast as possible.")
+        parser.add_argument("--protocol", choices=["json", "msgpack"], default="json")
+        parser.add_argument("--drain-timeout", type=float, default=30.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", dest="json_path", help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        overrides = {"CHANNEL_LAYERS": {"default": LAYERS[options["layer"]](options)}, **COMMON_OVERRIDES}
+        if options["layer"] == "memory":
+            overrides.update(IN_MEMORY_STORES)
+        # Persistence and receipts go to the database, which is not what is
+        # being measured here.
+        with override_settings(**overrides), \
+                mock.patch("chat.consumers.get_message_writer", return_value=mock.Mock(saturated=False)), \
+                mock.patch("chat.consumers.get_read_receipts", return_value=mock.Mock()):
+            results = asyncio.run(self.run(options))
+        results["commit"] = self.commit()
+
+        self.report(results)
+        if options["json_path"]:
+            with open(options["json_path"], "w") as fh:
+                json.dump(results, fh, indent=2)
+
+    async def run(self, options):
+        rng = random.Random(options["seed"])
+        application = URLRouter(websocket_urlpatterns)
+        rooms = [str(1_000_000 + room) for room in range(options["rooms"])]
+        clients = {
+            room: [Client(application, room, index * options["members"] + member + 1, options["protocol"])
+                   for member in range(options["members"])]
+            for index, room in enumerate(rooms)
+        }
+        everyone = [client for members in clients.values() for client in members]
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        await asyncio.gather(*(client.connect() for client in everyone))
+        connect_seconds = time.perf_counter() - started
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+        readers = [asyncio.create_task(client.read()) for client in everyone]
+        actions, weights = zip(*options["mix"].items())
+        plans = {room: rng.choices(actions, weights, k=options["actions"]) for room in rooms}
+        sent = {action: 0 for action in actions}
+
+        async def drive(room):
+            interval = 1 / options["rate"] if options["rate"] else 0
+            for action in plans[room]:
+                sender = rng.choice(clients[room])
+                if action == "message":
+                    await sender.send({"type": "message", "content": str(time.perf_counter_ns())})
+                else:
+                    await sender.send({"type": action})
+                sent[action] += 1
+                await asyncio.sleep(interval)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(drive(room) for room in rooms))
+        send_seconds = time.perf_counter() - started
+
+        expected = sent.get("message", 0) * options["members"]
+        deadline = time.perf_counter() + options["drain_timeout"]
+        while sum(len(client.latencies) for client in everyone) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(client.communicator.disconnect() for client in everyone), return_exceptions=True)
+
+        latencies = [latency for client in everyone for latency in client.latencies]
+        received = {}
+        for client in everyone:
+            for kind, count in client.received.items():
+                received[kind] = received.get(kind, 0) + count
+        return {
+            "config": {
+                key: options[key]
+                for key in ("layer", "rooms", "members", "actions", "mix", "rate", "protocol", "seed")
+            },
+            "connections": len(everyone),
+            "connect_seconds": round(connect_seconds, 3),
+            "memory_per_connection_bytes": round(allocated / len(everyone)),
+            "sent": sent,
+            "send_seconds": round(send_seconds, 3),
+            "actions_per_second": round(sum(sent.values()) / send_seconds, 1),
+            "received": received,
+            "deliveries_expected": expected,
+            "deliveries": len(latencies),
+            "deliveries_per_second": round(len(latencies) / elapsed, 1),
+            "latency_ms": {key: value and round(value, 3) for key, value in percentiles(latencies).items()},
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def report(self, results):
+        latency = results["latency_ms"]
+        self.stdout.write(
+            f"{results['connections']} connections in {results['connect_seconds']}s, "
+            f"~{results['memory_per_connection_bytes']:,} bytes each"
+        )
+        self.stdout.write(
+            f"sent {sum(results['sent'].values())} actions ({results['actions_per_second']}/s), "
+            f"delivered {results['deliveries']}/{results['deliveries_expected']} messages "
+            f"({results['deliveries_per_second']}/s)"
+        )
+        self.stdout.write(
+            f"latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}"
+        )
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from chat.archive import archive_messages, import_legacy_history
+from chat.history import get_history_store
+from chat.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Evict idle rooms from the Redis history window after making sure their messages are in "
+        "the database, and optionally pack old messages into compressed archive blocks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--idle", type=int, default=3600,
+                            help="Evict rooms with no new message for this many seconds.")
+        parser.add_argument("--archive-days", type=int,
+                            help="Also pack messages older than this many days into compressed blocks. "
+                                 "Archived messages are still served as WebSocket history, but no longer "
+                                 "show up in search or in the REST message listing.")
+        parser.add_argument("--keep", type=int, default=500,
+                            help="Messages per conversation that are never archived.")
+        parser.add_argument("--block-size", type=int, default=1000, help="Messages per archive block.")
+        parser.add_argument("--legacy", action="store_true",
+                            help="First import the history blobs older releases kept in the Django cache "
+                                 "into the database, and delete them.")
+
+    def handle(self, *args, **options):
+        store = get_history_store()
+        if store.archive is None:
+            raise CommandError("CHAT_HISTORY has no archive configured; evicting rooms would lose their history.")
+        if options["legacy"]:
+            if not hasattr(cache, "iter_keys"):
+                raise CommandError("The default cache cannot list keys; --legacy needs django-redis.")
+            imported, dropped = import_legacy_history(cache)
+            self.stdout.write(f"imported {imported} legacy messages, dropped {dropped}")
+        evicted, backfilled, failed = asyncio.run(self.evict(store, options["idle"]))
+        self.stdout.write(f"evicted {evicted} idle rooms, backfilled {backfilled} messages, {failed} rooms failed")
+
+        if options["archive_days"] is not None:
+            before = timezone.now() - timedelta(days=options["archive_days"])
+            conversations = (
+                Message.objects.filter(timestamp__lt=before, seq__isnull=False)
+                .values_list("conversation_id", flat=True)
+                .distinct()
+            )
+            archived = sum(
+                archive_messages(conversation, before, keep=options["keep"], block_size=options["block_size"])
+                for conversation in list(conversations)
+            )
+            self.stdout.write(f"archived {archived} messages")
+
+    async def evict(self, store, min_idle):
+        evicted = backfilled = failed = 0
+        async for group in store.idle_rooms(min_idle):
+            try:
+                last_seq, entries = await store.snapshot(group)
+                backfilled += await store.archive.backfill(group, entries)
+                # Skipped if a message arrived meanwhile; the next run gets it.
+                if await store.evict(group, last_seq):
+                    evicted += 1
+            except Exception:
+                # The room stays in Redis and is retried on the next run.
+                logger.exception("Compacting %s failed", group)
+                failed += 1
+        return evicted, backfilled, failed
@@ -0,0 +1,194 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .models import ConversationParticipant
+from .redis_client import Script, get_redis
+
+
+# Marks a loaded set, so a user in no conversations is still a cache hit.
+LOADED = "-"
+
+# Replaces a user's set with the ids read from the database, unless the
+# version moved while they were being read: an invalidation happened in
+# between and the snapshot may already be stale.
+FILL_SCRIPT = Script("""
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+# Adds ids to an already loaded set and bumps the version so an in-flight
+# fill cannot overwrite them with an older snapshot.
+ADD_SCRIPT = """
+redis.call('INCR', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], unpack(ARGV))
+end
+return 1
+"""
+
+
+class BaseMembershipIndex:
+    """
+    Per-user set of conversation ids, loaded lazily from
+    ``ConversationParticipant`` and kept current by invalidation.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60):
+        self.ttl = ttl
+
+    @database_sync_to_async
+    def load(self, user_id):
+        return set(
+            ConversationParticipant.objects.filter(user_id=user_id).values_list("conversation_id", flat=True)
+        )
+
+    async def is_member(self, user_id, conversation_id):
+        try:
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            return False
+        return conversation_id in await self.conversations(user_id)
+
+    async def conversations(self, user_id):
+        raise NotImplementedError("subclasses of BaseMembershipIndex must provide a conversations() method")
+
+    def add(self, user_id, *conversation_ids):
+        raise NotImplementedError("subclasses of BaseMembershipIndex must provide an add() method")
+
+    def add_members(self, conversation_id, user_ids):
+        """
+        Record that every user in ``user_ids`` joined ``conversation_id``.
+        Used where participants are bulk-created and no signals fire.
+        """
+        for user_id in user_ids:
+            self.add(user_id, conversation_id)
+
+    def invalidate(self, user_id):
+        raise NotImplementedError("subclasses of BaseMembershipIndex must provide an invalidate() method")
+
+
+class RedisMembershipIndex(BaseMembershipIndex):
+    """
+    Membership sets shared by every worker through Redis.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60, alias="default", prefix="membership"):
+        super().__init__(ttl=ttl)
+        self.alias = alias
+        self.prefix = prefix
+        self._add = None
+
+    def keys(self, user_id):
+        return [f"{self.prefix}:{user_id}", f"{self.prefix}:{user_id}:version"]
+
+    def connection(self):
+        """
+        Synchronous connection for writes made from signals and views.
+        """
+        from django_redis import get_redis_connection
+
+        conn = get_redis_connection(self.alias)
+        if self._add is None:
+            self._add = conn.register_script(ADD_SCRIPT)
+        return conn
+
+    async def is_member(self, user_id, conversation_id):
+        if not str(conversation_id).isdigit():
+            return False
+        members_key = self.keys(user_id)[0]
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.exists(members_key)
+            pipe.sismember(members_key, str(conversation_id))
+            loaded, is_member = await pipe.execute()
+        if loaded:
+            return bool(is_member)
+        return int(conversation_id) in await self._fill_from_database(user_id)
+
+    async def conversations(self, user_id):
+        members = await get_redis().smembers(self.keys(user_id)[0])
+        if members:
+            return {int(member) for member in members if member != LOADED.encode()}
+        return await self._fill_from_database(user_id)
+
+    async def _fill_from_database(self, user_id):
+        redis = get_redis()
+        version = await redis.get(self.keys(user_id)[1]) or b"0"
+        conversation_ids = await self.load(user_id)
+        await FILL_SCRIPT(
+            redis,
+            keys=self.keys(user_id),
+            args=[version, self.ttl, LOADED, *conversation_ids],
+        )
+        return conversation_ids
+
+    def add(self, user_id, *conversation_ids):
+        conn = self.connection()
+        self._add(keys=self.keys(user_id), args=list(conversation_ids), client=conn)
+
+    def add_members(self, conversation_id, user_ids):
+        conn = self.connection()
+        pipe = conn.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._add(keys=self.keys(user_id), args=[conversation_id], client=pipe)
+        pipe.execute()
+
+    def invalidate(self, user_id):
+        members_key, version_key = self.keys(user_id)
+        pipe = self.connection().pipeline(transaction=True)
+        pipe.incr(version_key)
+        pipe.delete(members_key)
+        pipe.execute()
+
+
+class InMemoryMembershipIndex(BaseMembershipIndex):
+    """
+    Process-local membership sets, for tests and single-process development.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60):
+        super().__init__(ttl=ttl)
+        self._members = {}
+
+    async def conversations(self, user_id):
+        if user_id not in self._members:
+            self._members[user_id] = await self.load(user_id)
+        return self._members[user_id]
+
+    def add(self, user_id, *conversation_ids):
+        if user_id in self._members:
+            self._members[user_id].update(int(conversation_id) for conversation_id in conversation_ids)
+
+    def set(self, user_id, conversation_ids):
+        self._members[user_id] = {int(conversation_id) for conversation_id in conversation_ids}
+
+    def invalidate(self, user_id):
+        self._members.pop(user_id, None)
+
+
+_index = None
+
+
+def get_membership_index():
+    """
+    Return the process-wide index configured by ``CHAT_MEMBERSHIP``.
+    """
+    global _index
+    if _index is None:
+        config = getattr(settings, "CHAT_MEMBERSHIP", {})
+        backend = import_string(config.get("BACKEND", "chat.membership.RedisMembershipIndex"))
+        _index = backend(**config.get("CONFIG", {}))
+    return _index
+
+
+@receiver(setting_changed)
+def _reset_membership_index(setting, **kwargs):
+    global _index
+    if setting == "CHAT_MEMBERSHIP":
+        _index = None
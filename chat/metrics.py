@@ -0,0 +1,109 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Client-supplied action names are mapped onto this set so a misbehaving
+# client cannot create new label values.
+ACTIONS = frozenset({
+    "join", "resume", "message", "typing", "stop_typing", "leave",
+    "history", "ping", "presence", "batch", "read",
+})
+# Upper bounds of the room size buckets, by local connections per room.
+ROOM_SIZES = (1, 10, 100, 1000)
+
+outbound_frames_shed = Counter(
+    "chat_outbound_frames_shed_total",
+    "Outbound WebSocket frames dropped because a connection fell behind.",
+    ["kind"],
+)
+slow_consumer_disconnects = Counter(
+    "chat_slow_consumer_disconnects_total",
+    "Connections closed for staying over their outbound queue budget.",
+)
+connections = Gauge(
+    "chat_ws_connections",
+    "Open chat WebSocket connections.",
+    multiprocess_mode="livesum",
+)
+rooms = Gauge(
+    "chat_ws_rooms",
+    "Rooms with connections, by number of connections on the worker serving them.",
+    ["size"],
+    multiprocess_mode="livesum",
+)
+actions = Counter(
+    "chat_ws_actions_total",
+    "Actions received from clients.",
+    ["action"],
+)
+rate_limited = Counter(
+    "chat_ws_rate_limited_total",
+    "Actions rejected by the rate limiter.",
+    ["action"],
+)
+receive_seconds = Histogram(
+    "chat_ws_receive_seconds",
+    "Time spent handling one received frame.",
+    ["action"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+history_seconds = Histogram(
+    "chat_history_seconds",
+    "History store latency.",
+    ["operation"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1),
+)
+messages_dropped = Counter(
+    "chat_messages_dropped_total",
+    "Messages that never reached the database.",
+    ["reason"],
+)
+message_writes_pending = Gauge(
+    "chat_message_writes_pending",
+    "Messages queued for the database writer.",
+    multiprocess_mode="livesum",
+)
+delivery_seconds = Histogram(
+    "chat_ws_delivery_seconds",
+    "Time from group_send to the frame being queued for a socket.",
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+
+
+def action_label(action):
+    return action if action in ACTIONS else "other"
+
+
+def size_label(size):
+    for bound in ROOM_SIZES:
+        if size <= bound:
+            return f"le_{bound}"
+    return f"gt_{ROOM_SIZES[-1]}"
+
+
+class RoomSizes:
+    """
+    Local connection count per room, reported as a gauge of how many rooms
+    fall into each size bucket rather than one series per room.
+    """
+
+    def __init__(self):
+        self._sizes = {}
+
+    def join(self, room):
+        self._move(room, 1)
+
+    def leave(self, room):
+        self._move(room, -1)
+
+    def _move(self, room, delta):
+        before = self._sizes.get(room, 0)
+        after = before + delta
+        if before:
+            rooms.labels(size_label(before)).dec()
+        if after > 0:
+            self._sizes[room] = after
+            rooms.labels(size_label(after)).inc()
+        else:
+            self._sizes.pop(room, None)
+
+
+room_sizes = RoomSizes()
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.11 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_message_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="chat_message_conv_ts_id_idx",
+            ),
+        ),
+    ]
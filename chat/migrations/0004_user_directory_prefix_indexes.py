@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# The directory searches with istartswith, which Postgres runs as
+# UPPER(column) LIKE 'PREFIX%'. Expression indexes with the pattern opclass
+# let those lookups seek instead of scanning auth_user.
+INDEXES = {
+    "chat_user_email_prefix_idx": "email",
+    "chat_user_first_name_prefix_idx": "first_name",
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("auth", "User")._meta.db_table)
+    for name, column in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} (UPPER({schema_editor.quote_name(column)}) varchar_pattern_ops)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("chat", "0003_message_conversation_timestamp_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
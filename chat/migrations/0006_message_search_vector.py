@@ -0,0 +1,47 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Must match chat.search.SEARCH_CONFIG.
+SEARCH_CONFIG = "english"
+INDEX_NAME = "chat_message_search_idx"
+
+
+def backfill_and_index(apps, schema_editor):
+    """
+    Fill the vector for existing rows, then build the GIN index in one pass,
+    which is much cheaper than maintaining it row by row during the backfill.
+    The index keeps GIN's default fastupdate, so later inserts land in its
+    pending list and are merged in bulk.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("chat", "Message")._meta.db_table)
+    schema_editor.execute(
+        f"UPDATE {table} SET search_vector = to_tsvector(%s, content) WHERE search_vector IS NULL",
+        [SEARCH_CONFIG],
+    )
+    schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} USING gin (search_vector)")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_message_seq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(backfill_and_index, drop_index),
+    ]
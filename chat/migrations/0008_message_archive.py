@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_readreceipt"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_seq", models.PositiveBigIntegerField()),
+                ("last_seq", models.PositiveBigIntegerField()),
+                ("count", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "seq"], name="chat_message_conv_seq_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="messagearchive",
+            name="conversation",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="archives",
+                to="chat.conversation",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="messagearchive",
+            index=models.Index(
+                fields=["conversation", "last_seq"], name="chat_archive_conv_last_idx"
+            ),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.contrib.auth import get_user_model
 User = get_user_model()
@@ -23,7 +25,58 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
     sender       = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
     content      = models.TextField()
-    timestamp    = models.DateTimeField(auto_now_add=True)
+    timestamp    = models.DateTimeField(default=timezone.now)
+    # Per-conversation sequence number assigned by the history store.
+    seq          = models.PositiveBigIntegerField(null=True, blank=True)
+    # Filled in by the message writer as part of each batched insert and
+    # GIN-indexed on Postgres by migration 0006.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a conversation's history.
+            models.Index(fields=["conversation", "timestamp", "id"], name="chat_message_conv_ts_id_idx"),
+            # History reads by sequence number once a room is out of Redis.
+            models.Index(fields=["conversation", "seq"], name="chat_message_conv_seq_idx"),
+        ]
 
     def __str__(self):
         return f"{self.sender.email}: {self.content[:20]}"
+
+class MessageArchive(models.Model):
+    """
+    A run of old messages of a conversation, packed by ``compact_history``
+    into one compressed block of history entries.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="archives")
+    first_seq    = models.PositiveBigIntegerField()
+    last_seq     = models.PositiveBigIntegerField()
+    count        = models.PositiveIntegerField()
+    # zlib-compressed msgpack list of entries, see chat.archive.pack().
+    data         = models.BinaryField()
+    created_at   = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation", "last_seq"], name="chat_archive_conv_last_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.conversation_id} messages {self.first_seq}-{self.last_seq}"
+
+class ReadReceipt(models.Model):
+    """
+    Highest message ``seq`` a participant has read in a conversation.
+    """
+    user          = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_receipts")
+    conversation  = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="read_receipts")
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+    updated_at    = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "conversation"], name="chat_readreceipt_user_conv_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} read {self.conversation_id} up to {self.last_read_seq}"
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import deque
+from . import metrics
+
+# Shed first: only the latest state matters and the next update replaces it.
+EPHEMERAL = frozenset({"chat.typing", "chat.read"})
+# Shed next: the client can ask for these again, so they collapse into a
+# single hint telling it to do so.
+REFETCHABLE = frozenset({"chat.history"})
+RESYNC = "chat.resync"
+RESYNC_FRAME = '{"type":"chat.resync"}'
+
+
+class OutboundQueue:
+    """
+    Bounded queue of encoded frames waiting to be written to one socket.
+
+    When more than ``max_size`` frames are waiting, frames are shed by
+    priority: typing indicators first, then history pages, which collapse
+    into one ``chat.resync`` frame. Room messages are never dropped; if they
+    alone keep the queue over budget for ``grace`` seconds, ``put`` reports
+    once that the connection should be closed; from then on the queue is
+    ``closing`` and discards whatever it is given.
+    """
+
+    def __init__(self, max_size=256, grace=10.0, resync_frame=RESYNC_FRAME):
+        self.max_size = max_size
+        self.grace = grace
+        self.resync_frame = resync_frame
+        self.over_budget_since = None
+        self.closing = False
+        self._frames = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, kind, text):
+        """
+        Queue a frame. Returns True, only once, when the connection has been
+        over budget for longer than ``grace`` and should be dropped.
+        """
+        if self.closing:
+            return False
+        self._frames.append((kind, text))
+        self._ready.set()
+        if len(self._frames) <= self.max_size:
+            self.over_budget_since = None
+            return False
+        self.shed()
+        if len(self._frames) <= self.max_size:
+            self.over_budget_since = None
+            return False
+        now = time.monotonic()
+        if self.over_budget_since is None:
+            self.over_budget_since = now
+        if now - self.over_budget_since <= self.grace:
+            return False
+        self.closing = True
+        self._frames.clear()
+        self._ready.clear()
+        return True
+
+    def shed(self):
+        self._drop(EPHEMERAL)
+        if len(self._frames) > self.max_size and self._drop(REFETCHABLE | {RESYNC}):
+            self._frames.append((RESYNC, self.resync_frame))
+
+    def _drop(self, kinds):
+        kept = deque(frame for frame in self._frames if frame[0] not in kinds)
+        dropped = len(self._frames) - len(kept)
+        for kind, _ in self._frames:
+            if kind in kinds and kind != RESYNC:
+                metrics.outbound_frames_shed.labels(kind=kind).inc()
+        self._frames = kept
+        return dropped
+
+    async def wait(self):
+        await self._ready.wait()
+
+    def pop(self, limit):
+        frames = []
+        while self._frames and len(frames) < limit:
+            frames.append(self._frames.popleft()[1])
+        if not self._frames:
+            self._ready.clear()
+            self.over_budget_since = None
+        return frames
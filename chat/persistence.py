@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DataError, IntegrityError, connection
+from django.dispatch import receiver
+from . import metrics
+from .models import Message
+from .search import message_vector
+
+logger = logging.getLogger(__name__)
+
+# Seconds between repeats of the queue-full warning.
+WARNING_INTERVAL = 10
+
+
+class MessageWriter:
+    """
+    Write-behind persistence of chat messages into ``Message``.
+
+    Consumers call ``enqueue`` which never touches the database; a background
+    task drains the queue and writes rows with ``bulk_create`` once either
+    ``batch_size`` messages are pending or ``flush_interval`` seconds passed
+    since the first one arrived. Failed batches are retried with exponential
+    backoff; a batch the database rejects outright, or that still fails
+    after the last retry, is written row by row so one bad row only costs
+    itself. When the queue is full new messages are rejected and counted in
+    ``dropped``, and ``saturated`` lets callers refuse work up front.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=0.5, max_queue_size=10000,
+                 max_retries=5, retry_delay=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.written = 0
+        self._warned_at = None
+        self._queue = None
+        self._task = None
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_queue_size
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = loop.create_task(self._run())
+
+    def enqueue(self, **fields):
+        """
+        Queue one ``Message`` for writing. Returns False if it was shed.
+        """
+        self.ensure_started()
+        try:
+            self._queue.put_nowait(Message(**fields))
+        except asyncio.QueueFull:
+            self._drop(1, "queue_full")
+            now = asyncio.get_running_loop().time()
+            if self._warned_at is None or now - self._warned_at >= WARNING_INTERVAL:
+                self._warned_at = now
+                logger.warning("Message write queue full, dropped %d messages so far", self.dropped)
+            return False
+        metrics.message_writes_pending.set(self.pending)
+        return True
+
+    async def flush(self):
+        """
+        Write everything queued so far. Used on shutdown and in tests.
+        """
+        if self._queue is None:
+            return
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            if len(batch) >= self.batch_size:
+                await self._write(batch)
+                batch = []
+        if batch:
+            await self._write(batch)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Don't lose what was already taken off the queue.
+                await self._write(batch)
+                raise
+            await self._write(batch)
+
+    async def _write(self, batch):
+        try:
+            await self._write_batch(batch)
+        finally:
+            metrics.message_writes_pending.set(self.pending)
+
+    async def _write_batch(self, batch):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self._bulk_create(batch)
+            except (IntegrityError, DataError):
+                # Retrying the same rows will not help; find the bad ones.
+                await self._write_each(batch)
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    logger.exception("Writing %d messages failed after %d attempts, trying one by one",
+                                     len(batch), attempt)
+                    await self._write_each(batch)
+                    return
+                logger.warning("Writing %d messages failed (attempt %d), retrying in %.1fs", len(batch), attempt, delay)
+                await asyncio.sleep(delay)
+                delay *= 2
+            else:
+                self.written += len(batch)
+                return
+
+    async def _write_each(self, batch):
+        for message in batch:
+            try:
+                await self._bulk_create([message])
+            except Exception as exc:
+                logger.warning("Dropping message %s of conversation %s: %s", message.seq, message.conversation_id, exc)
+                self._drop(1, "write_failed")
+            else:
+                self.written += 1
+
+    def _drop(self, count, reason):
+        self.dropped += count
+        metrics.messages_dropped.labels(reason).inc(count)
+
+    @database_sync_to_async
+    def _bulk_create(self, batch):
+        bulk_create_messages(batch, batch_size=self.batch_size)
+
+
+def bulk_create_messages(messages, batch_size=200):
+    if connection.vendor == "postgresql":
+        # Compute the search vector inside the same multi-row INSERT, so
+        # indexing costs no extra round trip or row update per message.
+        for message in messages:
+            message.search_vector = message_vector(message.content)
+    Message.objects.bulk_create(messages, batch_size=batch_size)
+
+
+_writer = None
+
+
+def get_message_writer():
+    """
+    Return the process-wide writer configured by ``CHAT_MESSAGE_WRITER``.
+    """
+    global _writer
+    if _writer is None:
+        _writer = MessageWriter(**getattr(settings, "CHAT_MESSAGE_WRITER", {}))
+    return _writer
+
+
+@receiver(setting_changed)
+def _reset_message_writer(setting, **kwargs):
+    global _writer
+    if setting == "CHAT_MESSAGE_WRITER":
+        _writer = None
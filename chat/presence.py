@@ -0,0 +1,136 @@
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .redis_client import get_redis
+
+
+class BasePresenceStore:
+    """
+    Tracks which users have a live socket in each conversation.
+
+    Each socket is recorded as ``"<user_id>:<channel_name>"`` with the time of
+    its last heartbeat, so a user with several tabs stays online until the
+    last one goes away. Entries older than ``timeout`` seconds are considered
+    stale and are swept whenever a room is written or read.
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+
+    @staticmethod
+    def member(user_id, channel_name):
+        return f"{user_id}:{channel_name}"
+
+    @staticmethod
+    def user_ids(members):
+        return sorted({int(member.split(":", 1)[0]) for member in members})
+
+    async def touch(self, conversation_id, user_id, channel_name):
+        raise NotImplementedError("subclasses of BasePresenceStore must provide a touch() method")
+
+    async def leave(self, conversation_id, user_id, channel_name):
+        raise NotImplementedError("subclasses of BasePresenceStore must provide a leave() method")
+
+    async def online(self, conversation_ids):
+        """
+        Return ``{conversation_id: [user_id, ...]}`` for every requested room.
+        """
+        raise NotImplementedError("subclasses of BasePresenceStore must provide an online() method")
+
+
+class RedisPresenceStore(BasePresenceStore):
+    """
+    Presence kept in one sorted set per conversation scored by heartbeat time.
+    """
+
+    def __init__(self, timeout=60, prefix="presence"):
+        super().__init__(timeout=timeout)
+        self.prefix = prefix
+
+    def key(self, conversation_id):
+        return f"{self.prefix}:{conversation_id}"
+
+    async def touch(self, conversation_id, user_id, channel_name):
+        now = time.time()
+        key = self.key(conversation_id)
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {self.member(user_id, channel_name): now})
+            pipe.zremrangebyscore(key, "-inf", now - self.timeout)
+            pipe.expire(key, self.timeout * 2)
+            await pipe.execute()
+
+    async def leave(self, conversation_id, user_id, channel_name):
+        await get_redis().zrem(self.key(conversation_id), self.member(user_id, channel_name))
+
+    async def online(self, conversation_ids):
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return {}
+        cutoff = time.time() - self.timeout
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for conversation_id in conversation_ids:
+                pipe.zrangebyscore(self.key(conversation_id), cutoff, "+inf")
+            results = await pipe.execute()
+        return {
+            conversation_id: self.user_ids(member.decode() for member in members)
+            for conversation_id, members in zip(conversation_ids, results)
+        }
+
+
+class InMemoryPresenceStore(BasePresenceStore):
+    """
+    Process-local presence, for tests and single-process development.
+    """
+
+    def __init__(self, timeout=60):
+        super().__init__(timeout=timeout)
+        self._rooms = {}
+
+    def _sweep(self, conversation_id, now):
+        room = self._rooms.get(str(conversation_id), {})
+        for member, seen in list(room.items()):
+            if seen <= now - self.timeout:
+                del room[member]
+        if not room:
+            self._rooms.pop(str(conversation_id), None)
+        return room
+
+    async def touch(self, conversation_id, user_id, channel_name):
+        now = time.time()
+        self._rooms.setdefault(str(conversation_id), {})[self.member(user_id, channel_name)] = now
+        self._sweep(conversation_id, now)
+
+    async def leave(self, conversation_id, user_id, channel_name):
+        self._rooms.get(str(conversation_id), {}).pop(self.member(user_id, channel_name), None)
+        self._sweep(conversation_id, time.time())
+
+    async def online(self, conversation_ids):
+        now = time.time()
+        return {
+            conversation_id: self.user_ids(self._sweep(conversation_id, now))
+            for conversation_id in conversation_ids
+        }
+
+
+_store = None
+
+
+def get_presence_store():
+    """
+    Return the process-wide presence store configured by ``CHAT_PRESENCE``.
+    """
+    global _store
+    if _store is None:
+        config = getattr(settings, "CHAT_PRESENCE", {})
+        backend = import_string(config.get("BACKEND", "chat.presence.RedisPresenceStore"))
+        _store = backend(**config.get("CONFIG", {}))
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_presence_store(setting, **kwargs):
+    global _store
+    if setting == "CHAT_PRESENCE":
+        _store = None
@@ -0,0 +1,133 @@
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .redis_client import Script, get_redis
+
+
+# Token bucket kept in a Redis hash per (action, user). The script refills
+# from Redis' own clock so every worker agrees on the time, and returns
+# whether the call was allowed plus the seconds until the next token.
+TOKEN_BUCKET_SCRIPT = Script("""
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+""")
+
+
+class BaseRateLimiter:
+    """
+    Per-user, per-action token buckets.
+
+    ``limits`` maps an action name to ``{"rate": tokens per second,
+    "burst": bucket size}``. Actions without a limit are always allowed.
+    ``allow`` returns ``(allowed, retry_after)`` with ``retry_after`` in
+    seconds.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or {}
+
+    async def allow(self, action, user_id):
+        limit = self.limits.get(action)
+        if limit is None:
+            return True, 0.0
+        return await self.take(action, user_id, float(limit["rate"]), float(limit.get("burst", 1)))
+
+    async def take(self, action, user_id, rate, burst):
+        raise NotImplementedError("subclasses of BaseRateLimiter must provide a take() method")
+
+
+class RedisRateLimiter(BaseRateLimiter):
+    """
+    Token buckets shared by every worker through Redis.
+    """
+
+    def __init__(self, limits=None, prefix="ratelimit"):
+        super().__init__(limits=limits)
+        self.prefix = prefix
+
+    async def take(self, action, user_id, rate, burst):
+        allowed, retry_after = await TOKEN_BUCKET_SCRIPT(
+            get_redis(),
+            keys=[f"{self.prefix}:{action}:{user_id}"],
+            args=[rate, burst],
+        )
+        return bool(allowed), float(retry_after)
+
+
+class InMemoryRateLimiter(BaseRateLimiter):
+    """
+    Process-local token buckets, for tests and single-process runs.
+
+    Buckets that have refilled completely are indistinguishable from new
+    ones, so they are swept every ``sweep_interval`` seconds to keep memory
+    proportional to recently active users.
+    """
+
+    def __init__(self, limits=None, sweep_interval=60):
+        super().__init__(limits=limits)
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    async def take(self, action, user_id, rate, burst):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        key = (action, user_id)
+        tokens, ts, _ = self._buckets.get(key, (burst, now, None))
+        tokens = min(burst, tokens + (now - ts) * rate)
+        full_at = now + (burst - tokens) / rate
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now, full_at + 1 / rate)
+            return True, 0.0
+        self._buckets[key] = (tokens, now, full_at)
+        return False, (1 - tokens) / rate
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._last_sweep = now
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter configured by ``CHAT_RATE_LIMITER``.
+    """
+    global _limiter
+    if _limiter is None:
+        config = getattr(settings, "CHAT_RATE_LIMITER", {})
+        backend = import_string(config.get("BACKEND", "chat.ratelimit.RedisRateLimiter"))
+        _limiter = backend(**config.get("CONFIG", {}))
+    return _limiter
+
+
+@receiver(setting_changed)
+def _reset_rate_limiter(setting, **kwargs):
+    global _limiter
+    if setting == "CHAT_RATE_LIMITER":
+        _limiter = None
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DataError, IntegrityError, connection
+from django.dispatch import receiver
+from django.utils import timezone
+from . import encoding
+from .models import ReadReceipt
+
+logger = logging.getLogger(__name__)
+
+
+class ReadReceiptWriter:
+    """
+    Coalesces read acknowledgements into per-(user, conversation) high
+    watermarks.
+
+    ``ack`` only records the highest sequence number seen in memory. Every
+    ``flush_interval`` seconds the pending watermarks are upserted into
+    ``ReadReceipt`` in one statement, and each room gets a single
+    ``chat.read`` frame listing whose watermark moved, so a burst of acks
+    costs one write and one fanout per interval rather than one per ack.
+    Watermarks never move backwards, even when several workers flush the
+    same row out of order. A receipt the database rejects outright, e.g.
+    for a conversation that was deleted, is dropped on its own rather than
+    holding back the rest.
+    """
+
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        # (user_id, conversation_id) -> seq, not yet written
+        self._pending = {}
+        # (user_id, conversation_id) -> highest seq acked on this worker
+        self._acked = {}
+        # group -> {user_id: seq}, not yet broadcast
+        self._fanout = {}
+        self._task = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    def ack(self, user_id, conversation_id, group, seq):
+        self.ensure_started()
+        key = (user_id, int(conversation_id))
+        if seq <= self._acked.get(key, 0):
+            return
+        self._acked[key] = seq
+        self._pending[key] = seq
+        room = self._fanout.setdefault(group, {})
+        room[user_id] = max(seq, room.get(user_id, 0))
+
+    async def flush(self):
+        fanout, self._fanout = self._fanout, {}
+        channel_layer = get_channel_layer()
+        for group, receipts in fanout.items():
+            await channel_layer.group_send(group, encoding.event({
+                'type': 'chat.read',
+                'receipts': [{'user_id': user_id, 'seq': seq} for user_id, seq in receipts.items()],
+            }))
+
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await self._upsert(pending)
+        except (IntegrityError, DataError):
+            await self._upsert_each(pending)
+        except Exception:
+            logger.exception("Writing %d read receipts failed, will retry", len(pending))
+            self._requeue(pending)
+
+    async def _upsert_each(self, pending):
+        for key, seq in pending.items():
+            try:
+                await self._upsert({key: seq})
+            except (IntegrityError, DataError) as exc:
+                logger.warning("Dropping read receipt %s up to %d: %s", key, seq, exc)
+            except Exception:
+                logger.exception("Writing read receipt %s failed, will retry", key)
+                self._requeue({key: seq})
+
+    def _requeue(self, pending):
+        for key, seq in pending.items():
+            self._pending[key] = max(seq, self._pending.get(key, 0))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    @database_sync_to_async
+    def _upsert(self, pending):
+        table = connection.ops.quote_name(ReadReceipt._meta.db_table)
+        greatest = "GREATEST" if connection.vendor == "postgresql" else "MAX"
+        now = timezone.now()
+        rows = ", ".join(["(%s, %s, %s, %s)"] * len(pending))
+        params = [
+            value
+            for (user_id, conversation_id), seq in pending.items()
+            for value in (user_id, conversation_id, seq, now)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, conversation_id, last_read_seq, updated_at) VALUES {rows} "
+                f"ON CONFLICT (user_id, conversation_id) DO UPDATE SET "
+                f"last_read_seq = {greatest}({table}.last_read_seq, EXCLUDED.last_read_seq), "
+                f"updated_at = EXCLUDED.updated_at",
+                params,
+            )
+
+
+_writer = None
+
+
+def get_read_receipts():
+    """
+    Return the process-wide receipt writer configured by ``CHAT_READ_RECEIPTS``.
+    """
+    global _writer
+    if _writer is None:
+        _writer = ReadReceiptWriter(**getattr(settings, "CHAT_READ_RECEIPTS", {}))
+    return _writer
+
+
+@receiver(setting_changed)
+def _reset_read_receipts(setting, **kwargs):
+    global _writer
+    if setting == "CHAT_READ_RECEIPTS":
+        _writer = None
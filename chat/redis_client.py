@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+import weakref
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from redis import asyncio as aioredis
+from redis.exceptions import NoScriptError
+
+# One pool per event loop: asyncio connections cannot be shared across loops,
+# and a uvicorn worker runs a single loop for its whole lifetime.
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """
+    Return an asyncio Redis client backed by this process' shared pool.
+
+    The pool is bounded by ``CHAT_REDIS["MAX_CONNECTIONS"]``; when every
+    connection is busy callers wait up to ``CHAT_REDIS["POOL_TIMEOUT"]``
+    seconds instead of opening more.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        config = settings.CHAT_REDIS
+        pool = aioredis.BlockingConnectionPool.from_url(
+            config["URL"],
+            max_connections=config.get("MAX_CONNECTIONS", 50),
+            timeout=config.get("POOL_TIMEOUT", 5),
+        )
+        _pools[loop] = pool
+    return aioredis.Redis(connection_pool=pool)
+
+
+class Script:
+    """
+    A Lua script run by SHA, loaded into Redis on first use.
+
+    Unlike ``Redis.register_script`` it is not tied to a client, so it can
+    be defined at import time and run on whichever pool the loop has.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    async def __call__(self, client, keys=(), args=()):
+        try:
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            return await client.eval(self.source, len(keys), *keys, *args)
+
+
+@receiver(setting_changed)
+def _reset_pools(setting, **kwargs):
+    if setting == "CHAT_REDIS":
+        _pools.clear()
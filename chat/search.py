@@ -0,0 +1,13 @@
+from django.contrib.postgres.search import SearchVector
+from django.db.models import Value
+
+# Text search configuration used for both indexing and querying messages.
+SEARCH_CONFIG = "english"
+
+
+def message_vector(content):
+    """
+    Expression computing a message's search vector from its text, for use
+    in an INSERT where the row's own columns cannot be referenced.
+    """
+    return SearchVector(Value(content), config=SEARCH_CONFIG)
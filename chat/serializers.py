@@ -21,7 +21,7 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
         owner = validated_data.pop("owner")
         owner = User.objects.get(id=owner["id"])
         conversation = Conversation.objects.create(owner=owner, **validated_data)
-        logger.info("ConversationCreateSerializer create conversation", conversation)
+        logger.info("ConversationCreateSerializer create conversation", extra={"conversation": conversation.id})
         return conversation
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -32,6 +32,13 @@ class ConversationSerializer(serializers.ModelSerializer):
         model = Conversation
         fields = ("id", "title", "created_at", "owner")
 
+class ConversationListSerializer(ConversationSerializer):
+    last_message = serializers.JSONField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ConversationSerializer.Meta.fields + ("last_message", "unread_count")
+
 class ConversationParticipantSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     conversation = ConversationSerializer()
@@ -45,7 +52,8 @@ class ConversationParticipantSerializer(serializers.ModelSerializer):
         user = User.objects.get(id=user["id"])
         conversation = Conversation.objects.get(id=conversation["id"])
         conversation_participant = ConversationParticipant.objects.create(user=user, conversation=conversation, **validated_data)
-        logger.info("ConversationParticipantSerializer create conversation_participant", conversation_participant)
+        logger.info("ConversationParticipantSerializer create conversation_participant",
+                    extra={"conversation": conversation_participant.conversation_id, "user": conversation_participant.user_id})
         return conversation_participant
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -56,3 +64,11 @@ class MessageSerializer(serializers.ModelSerializer):
         model = Message
         fields = ("id", "conversation", "sender", "content", "timestamp")
         read_only_fields = ("timestamp",)
+
+
+class MessagePageSerializer(serializers.ModelSerializer):
+    user = serializers.ReadOnlyField(source="sender.first_name")
+
+    class Meta:
+        model = Message
+        fields = ("id", "seq", "sender", "user", "content", "timestamp")
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .directory import bump_directory_version
+from .membership import get_membership_index
+from .models import ConversationParticipant, User
+
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def invalidate_membership(sender, instance, **kwargs):
+    # After commit, so a connect elsewhere cannot reload the cached set from
+    # the rows as they were before this change.
+    user_id = instance.user_id
+    transaction.on_commit(lambda: get_membership_index().invalidate(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_directory(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which the directory does not show.
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    bump_directory_version()
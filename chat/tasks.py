@@ -0,0 +1,23 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def spawn(coro, tasks):
+    """
+    Run ``coro`` as a task that ``tasks`` holds on to until it finishes.
+    The event loop only keeps weak references to tasks, so a fire-and-forget
+    task can be garbage collected mid-run; its exception, if it has one, is
+    logged here instead of surfacing as "Task exception was never retrieved".
+    """
+    task = asyncio.get_running_loop().create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(lambda task: _finished(task, tasks))
+    return task
+
+
+def _finished(task, tasks):
+    tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task %s failed", task.get_coro().__qualname__, exc_info=task.exception())
@@ -0,0 +1,138 @@
+import fnmatch
+import json
+from datetime import timedelta
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from chat.archive import ArchivedHistory, archive_messages, conversation_id, import_legacy_history, unpack
+from chat.history import get_history_store
+from chat.models import Conversation, ConversationParticipant, Message, MessageArchive
+
+User = get_user_model()
+
+
+@pytest.fixture
+def conversation():
+    owner = User.objects.create_user(username="alice@example.com", email="alice@example.com", first_name="alice", password="pw")
+    return Conversation.objects.create(owner=owner)
+
+
+def add_messages(conversation, seqs, age=timedelta(0)):
+    Message.objects.bulk_create([
+        Message(conversation=conversation, sender=conversation.owner, content=str(seq), seq=seq,
+                timestamp=timezone.now() - age)
+        for seq in seqs
+    ])
+
+
+def test_conversation_id_of_group():
+    assert conversation_id("chat_12") == 12
+    assert conversation_id("chat_lobby") is None
+    assert conversation_id("other_12") is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_archived_blocks_read_like_rows(conversation):
+    add_messages(conversation, range(1, 8), age=timedelta(days=10))
+    add_messages(conversation, range(8, 10))
+    archived = archive_messages(conversation.id, timezone.now() - timedelta(days=1), keep=3, block_size=3)
+
+    assert archived == 6
+    assert list(MessageArchive.objects.values_list("first_seq", "last_seq", "count")) == [(1, 3, 3), (4, 6, 3)]
+    assert [entry["message"] for entry in unpack(MessageArchive.objects.first().data)] == ["1", "2", "3"]
+    assert list(Message.objects.order_by("seq").values_list("seq", flat=True)) == [7, 8, 9]
+
+    archive = ArchivedHistory()
+    group = f"chat_{conversation.id}"
+    entries = async_to_sync(archive.between)(group, 5, 8)
+    assert [(entry["seq"], entry["message"], entry["user"]) for entry in entries] == [
+        (5, "5", "alice"), (6, "6", "alice"), (7, "7", "alice"), (8, "8", "alice"),
+    ]
+    assert async_to_sync(archive.last_seq)(group) == 9
+    assert [entry["seq"] for entry in async_to_sync(archive.latest)(group, 4)] == [6, 7, 8, 9]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_HISTORY={
+    "BACKEND": "chat.history.InMemoryHistoryStore",
+    "CONFIG": {"archive": "chat.archive.ArchivedHistory"},
+})
+def test_compact_history_backfills_and_evicts_idle_rooms(conversation):
+    group = f"chat_{conversation.id}"
+    store = get_history_store()
+    for seq in [1, 2, 3]:
+        entry = {"user": "alice", "user_id": conversation.owner.id, "message": str(seq),
+                 "timestamp": timezone.now().isoformat()}
+        assert async_to_sync(store.append)(group, entry) == seq
+    add_messages(conversation, [1, 2])
+
+    call_command("compact_history", idle=0)
+
+    # The message the writer never stored was saved before the room left
+    # the store, and the room's counter carries on where it stopped.
+    assert list(Message.objects.order_by("seq").values_list("seq", flat=True)) == [1, 2, 3]
+    assert async_to_sync(store.snapshot)(group) == (0, [])
+    assert [entry["message"] for entry in async_to_sync(store.latest)(group, 10)] == ["1", "2", "3"]
+    assert async_to_sync(store.append)(group, {"message": "4"}) == 4
+
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_HISTORY={
+    "BACKEND": "chat.history.InMemoryHistoryStore",
+    "CONFIG": {"archive": "chat.archive.ArchivedHistory"},
+})
+def test_compact_history_skips_rooms_that_fail(conversation, monkeypatch, capsys):
+    store = get_history_store()
+    entry = {"user": "alice", "user_id": conversation.owner.id, "message": "hi", "timestamp": timezone.now().isoformat()}
+    for group in ("chat_lobby", f"chat_{conversation.id}"):
+        async_to_sync(store.append)(group, entry)
+    backfill = store.archive.backfill
+
+    async def flaky_backfill(group, entries):
+        if group == "chat_lobby":
+            raise RuntimeError("database unavailable")
+        return await backfill(group, entries)
+
+    monkeypatch.setattr(store.archive, "backfill", flaky_backfill)
+    call_command("compact_history", idle=0)
+
+    assert "evicted 1 idle rooms, backfilled 1 messages, 1 rooms failed" in capsys.readouterr().out
+    assert async_to_sync(store.snapshot)("chat_lobby")[0] == 1
+    assert Message.objects.count() == 1
+
+class KeyedCache(dict):
+    """
+    The part of the django-redis cache API ``import_legacy_history`` uses.
+    """
+
+    def iter_keys(self, pattern):
+        return iter(fnmatch.filter(list(self), pattern))
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+@pytest.mark.django_db
+def test_import_legacy_history(conversation):
+    bob = User.objects.create_user(username="bob@example.com", email="bob@example.com", first_name="bob", password="pw")
+    for user in (conversation.owner, bob):
+        ConversationParticipant.objects.create(conversation=conversation, user=user)
+    cache = KeyedCache({
+        f"chat:chat_{conversation.id}:messages": json.dumps([
+            {"user": "alice", "message": "hi", "timestamp": "2024-05-01T10:00:00+00:00"},
+            {"user": "bob", "message": "hey", "timestamp": "2024-05-01T10:01:00+00:00"},
+            {"user": "carol", "message": "who?", "timestamp": "2024-05-01T10:02:00+00:00"},
+        ]),
+        "chat:chat_lobby:messages": json.dumps({"user": "alice", "message": "x", "timestamp": "2024-05-01"}),
+        "chat:chat_9:other": "kept",
+    })
+
+    assert import_legacy_history(cache) == (2, 2)
+    assert list(Message.objects.order_by("timestamp").values_list("sender__first_name", "content", "seq")) == [
+        ("alice", "hi", None), ("bob", "hey", None),
+    ]
+    assert cache == {"chat:chat_9:other": "kept"}
@@ -1,6 +1,16 @@
+import asyncio
+import json
+import msgpack
 import pytest
+from prometheus_client import REGISTRY
+from types import SimpleNamespace
 from channels.testing import WebsocketCommunicator
+from chat import encoding
 from chat.consumers import ChatConsumer
+from chat.history import get_history_store
+from chat.membership import get_membership_index
+from chat.outbound import OutboundQueue
+from chat.presence import get_presence_store
 from django.test import override_settings
 from channels.layers import get_channel_layer
 from django.urls import re_path
@@ -10,63 +20,410 @@ application = URLRouter([
     re_path(r"ws/chat/(?P<conversation_id>\w+)/$", ChatConsumer.as_asgi()),   
 ])
 
+IN_MEMORY_BACKENDS = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "CHAT_HISTORY": {"BACKEND": "chat.history.InMemoryHistoryStore"},
+    "CHAT_RATE_LIMITER": {"BACKEND": "chat.ratelimit.InMemoryRateLimiter"},
+    "CHAT_PRESENCE": {"BACKEND": "chat.presence.InMemoryPresenceStore"},
+    "CHAT_MEMBERSHIP": {"BACKEND": "chat.membership.InMemoryMembershipIndex"},
+}
+
+
+@pytest.fixture(autouse=True)
+def written_messages(monkeypatch):
+    written = []
+    writer = SimpleNamespace(enqueue=lambda **fields: written.append(fields) or True, saturated=False)
+    monkeypatch.setattr("chat.consumers.get_message_writer", lambda: writer)
+    return written
+
+
+@pytest.fixture(autouse=True)
+def read_acks(monkeypatch):
+    acks = []
+    receipts = SimpleNamespace(ack=lambda user_id, conversation_id, group, seq: acks.append((user_id, seq)))
+    monkeypatch.setattr("chat.consumers.get_read_receipts", lambda: receipts)
+    return acks
+
+
+def make_communicator(conversation_id="1", user_id=1, first_name="alice", member=True, subprotocols=None):
+    get_membership_index().set(user_id, [conversation_id] if member else [])
+    communicator = WebsocketCommunicator(application, f"/ws/chat/{conversation_id}/", subprotocols=subprotocols)
+    communicator.scope["user"] = SimpleNamespace(id=user_id, first_name=first_name, is_authenticated=True)
+    return communicator
+
+
 @pytest.mark.asyncio
-@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+@override_settings(**IN_MEMORY_BACKENDS)
 async def test_websocket_connection():
-    communicator = WebsocketCommunicator(application, "/ws/chat/test_conversation_id")
+    communicator = make_communicator(conversation_id="10")
     connected, _ = await communicator.connect()
     assert connected
     await communicator.disconnect()
 
+
 @pytest.mark.asyncio
-@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+@override_settings(**IN_MEMORY_BACKENDS)
 async def test_receive_message():
-    communicator = WebsocketCommunicator(application, "/ws/chat/test_conversation_id")
+    communicator = make_communicator(conversation_id="11")
     await communicator.connect()
 
     # Send a message to the WebSocket
-    await communicator.send_json_to({"type": "message", "message": "hello"})
+    await communicator.send_json_to({"type": "message", "content": "hello"})
 
-    # Receive a message from the WebSocket
+    # Receive the broadcast of it from the WebSocket
     response = await communicator.receive_json_from()
-    assert response == {"type": "chat.message", "user": "testuser", "message": "hello"}
+    assert response["type"] == "chat.message"
+    message = response["message"]
+    assert message.pop("timestamp")
+    assert message == {"user": "alice", "user_id": 1, "message": "hello", "seq": 1}
 
     await communicator.disconnect()
 
+
 @pytest.mark.asyncio
-@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+@override_settings(**IN_MEMORY_BACKENDS)
 async def test_broadcast_message():
     channel_layer = get_channel_layer()
-    communicator1 = WebsocketCommunicator(application, "/ws/chat/test_conversation_id")
-    communicator2 = WebsocketCommunicator(application, "/ws/chat/test_conversation_id")
+    communicator1 = make_communicator(conversation_id="12")
+    communicator2 = make_communicator(conversation_id="12", user_id=2, first_name="bob")
     await communicator1.connect()
     await communicator2.connect()
 
-    # Send a message to the channel layer
+    # Send a message to the room's group on the channel layer
     await channel_layer.group_send(
-        "chat",
-        {
+        "chat_12",
+        encoding.event({
             "type": "chat.message",
             "message": {"user": "testuser", "message": "hello everyone"},
-        }
+        })
     )
 
     # Receive the message from both communicators
     response1 = await communicator1.receive_json_from()
     response2 = await communicator2.receive_json_from()
-    assert response1 == {"type": "chat.message", "user": "testuser", "message": "hello everyone"}
-    assert response2 == {"message": "hello everyone"}
+    assert response1 == {"type": "chat.message", "message": {"user": "testuser", "message": "hello everyone"}}
+    assert response2 == response1
 
     await communicator1.disconnect()
     await communicator2.disconnect()
 
+
 @pytest.mark.asyncio
-@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+@override_settings(**IN_MEMORY_BACKENDS)
 async def test_disconnect():
-    communicator = WebsocketCommunicator(application, "/ws/chat/test_conversation_id")
+    communicator = make_communicator(conversation_id="13")
     await communicator.connect()
+    assert await get_presence_store().online(["13"]) == {"13": [1]}
     await communicator.disconnect()
 
-    # Try to send a message after disconnect
-    with pytest.raises(Exception):
-        await communicator.send_json_to({"type": "message", "message": "should fail"})
+    # The consumer has finished and the socket left the room
+    assert communicator.future.done()
+    assert await get_presence_store().online(["13"]) == {"13": []}
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_presence_ignores_malformed_conversation_ids():
+    communicator = make_communicator(conversation_id="14")
+    await communicator.connect()
+
+    await communicator.send_json_to({"type": "presence", "conversation_ids": 5})
+    await communicator.send_json_to({"type": "presence", "conversation_ids": ["14", "99"]})
+    assert await communicator.receive_json_from() == {"type": "chat.presence", "online": {"14": [1]}}
+
+    await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_history_pages_only_reach_requester():
+    store = get_history_store()
+    for i in range(5):
+        await store.append("chat_1", {"user": "alice", "message": str(i)})
+    requester = make_communicator()
+    bystander = make_communicator(user_id=2, first_name="bob")
+    await requester.connect()
+    await bystander.connect()
+
+    await requester.send_json_to({"type": "history", "limit": 2})
+    response = await requester.receive_json_from()
+    assert response["type"] == "chat.history"
+    assert [msg["seq"] for msg in response["messages"]] == [4, 5]
+    assert response["next_cursor"] == 4
+
+    await requester.send_json_to({"type": "history", "before": response["next_cursor"], "limit": 3})
+    response = await requester.receive_json_from()
+    assert [msg["seq"] for msg in response["messages"]] == [1, 2, 3]
+    assert response["next_cursor"] is None
+
+    await requester.send_json_to({"type": "history", "after": 3, "limit": 2})
+    response = await requester.receive_json_from()
+    assert [msg["seq"] for msg in response["messages"]] == [4, 5]
+
+    assert await bystander.receive_nothing()
+    await requester.disconnect()
+    await bystander.disconnect()
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_broadcast_frame_is_encoded_once(written_messages):
+    sender = make_communicator(conversation_id="2")
+    receiver = make_communicator(conversation_id="2", user_id=2, first_name="bob")
+    await sender.connect()
+    await receiver.connect()
+
+    await sender.send_json_to({"type": "message", "content": "hello"})
+    sent = await sender.receive_from()
+    received = await receiver.receive_from()
+    assert sent == received
+    assert json.loads(received)["message"]["message"] == "hello"
+
+    await receiver.send_json_to({"type": "join"})
+    await sender.receive_from()
+    frames = {}
+    for _ in range(2):
+        frame = await receiver.receive_json_from()
+        frames[frame["type"]] = frame
+    assert "messages" not in frames["chat.join"]
+    assert [msg["message"] for msg in frames["chat.history"]["messages"]] == ["hello"]
+    assert [(fields["content"], fields["seq"]) for fields in written_messages] == [("hello", 1)]
+
+    await sender.disconnect()
+    await receiver.disconnect()
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_connect_requires_membership():
+    outsider = make_communicator(conversation_id="3", member=False)
+    connected, _ = await outsider.connect()
+    assert not connected
+
+    member = make_communicator(conversation_id="3", user_id=2)
+    connected, _ = await member.connect()
+    assert connected
+    await member.disconnect()
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_batching_flushes_events_in_order():
+    sender = make_communicator(conversation_id="4")
+    receiver = make_communicator(conversation_id="4", user_id=2, first_name="bob")
+    await sender.connect()
+    await receiver.connect()
+
+    await receiver.send_json_to({"type": "batch", "window_ms": 20})
+    assert (await receiver.receive_json_from())["window_ms"] == 20
+
+    for content in ["one", "two", "three"]:
+        await sender.send_json_to({"type": "message", "content": content})
+        await sender.receive_from()
+
+    batch = await receiver.receive_json_from()
+    assert batch["type"] == "chat.batch"
+    assert [event["message"]["message"] for event in batch["events"]] == ["one", "two", "three"]
+    assert await receiver.receive_nothing()
+
+    await sender.disconnect()
+    await receiver.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(CHAT_BATCH_MAX_EVENTS=2)
+async def test_batch_backlog_drains_without_waiting_for_the_window():
+    consumer = ChatConsumer()
+    consumer.codec = encoding.JSONCodec
+    consumer.outbound = OutboundQueue()
+    consumer.batch_window = 60
+    sent = []
+
+    async def send(text_data):
+        sent.append(json.loads(text_data))
+
+    consumer.send = send
+    for n in range(5):
+        consumer.outbound.put("chat.message", json.dumps({"type": "chat.message", "n": n}))
+    writer = asyncio.create_task(consumer.write_outbound())
+    try:
+        for _ in range(100):
+            if len(sent) == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        writer.cancel()
+
+    assert [[event["n"] for event in frame["events"]] for frame in sent[:2]] == [[0, 1], [2, 3]]
+    assert sent[2] == {"type": "chat.message", "n": 4}
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_msgpack_subprotocol_uses_binary_frames():
+    sender = make_communicator(conversation_id="5", subprotocols=["chat.msgpack", "chat.json"])
+    receiver = make_communicator(conversation_id="5", user_id=2, first_name="bob")
+    connected, subprotocol = await sender.connect()
+    assert connected and subprotocol == "chat.msgpack"
+    connected, subprotocol = await receiver.connect()
+    assert connected and subprotocol is None
+
+    await sender.send_to(bytes_data=msgpack.packb({"type": "message", "content": "hello"}))
+    sent = msgpack.unpackb(await sender.receive_from())
+    received = await receiver.receive_json_from()
+    assert sent == received
+    assert sent["message"]["message"] == "hello"
+
+    await sender.send_to(bytes_data=msgpack.packb({"type": "batch", "window_ms": 20}))
+    await sender.receive_from()
+    for content in ["one", "two"]:
+        await receiver.send_json_to({"type": "message", "content": content})
+        await receiver.receive_from()
+    batch = msgpack.unpackb(await sender.receive_from())
+    assert batch["type"] == "chat.batch"
+    assert [event["message"]["message"] for event in batch["events"]] == ["one", "two"]
+
+    await sender.disconnect()
+    await receiver.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS, CHAT_RESUME_MAX_MESSAGES=3)
+async def test_resume_replays_only_the_delta():
+    store = get_history_store()
+    for i in range(6):
+        await store.append("chat_6", {"user": "alice", "message": str(i)})
+    client = make_communicator(conversation_id="6")
+    bystander = make_communicator(conversation_id="6", user_id=2, first_name="bob")
+    await client.connect()
+    await bystander.connect()
+
+    await client.send_json_to({"type": "resume", "last_seq": 4})
+    response = await client.receive_json_from()
+    assert response["type"] == "chat.resume"
+    assert [msg["seq"] for msg in response["messages"]] == [5, 6]
+
+    await client.send_json_to({"type": "resume", "last_seq": 6})
+    assert (await client.receive_json_from())["messages"] == []
+
+    # More missed messages than a replay may carry: reload instead.
+    await client.send_json_to({"type": "resume", "last_seq": 1})
+    response = await client.receive_json_from()
+    assert response["type"] == "chat.history"
+    assert response["reset"] is True
+    assert await bystander.receive_nothing()
+
+    await client.disconnect()
+    await bystander.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_retried_client_msg_id_is_acked_not_rebroadcast(written_messages):
+    sender = make_communicator(conversation_id="7")
+    receiver = make_communicator(conversation_id="7", user_id=2, first_name="bob")
+    await sender.connect()
+    await receiver.connect()
+
+    await sender.send_json_to({"type": "message", "content": "hi", "client_msg_id": "abc"})
+    frames = {}
+    for _ in range(2):
+        frame = await sender.receive_json_from()
+        frames[frame["type"]] = frame
+    assert frames["chat.ack"] == {"type": "chat.ack", "client_msg_id": "abc", "seq": 1, "duplicate": False}
+    assert frames["chat.message"]["message"]["client_msg_id"] == "abc"
+    assert (await receiver.receive_json_from())["message"]["seq"] == 1
+
+    await sender.send_json_to({"type": "message", "content": "hi", "client_msg_id": "abc"})
+    assert await sender.receive_json_from() == {
+        "type": "chat.ack", "client_msg_id": "abc", "seq": 1, "duplicate": True
+    }
+    assert await receiver.receive_nothing()
+    assert len(written_messages) == 1
+    assert len(await get_history_store().latest("chat_7")) == 1
+
+    await sender.disconnect()
+    await receiver.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**{**IN_MEMORY_BACKENDS, "CHAT_RATE_LIMITER": {
+    "BACKEND": "chat.ratelimit.InMemoryRateLimiter",
+    "CONFIG": {"limits": {"message": {"rate": 0.001, "burst": 1}}},
+}})
+async def test_retry_is_acked_past_the_rate_limit():
+    sender = make_communicator(conversation_id="9")
+    await sender.connect()
+
+    await sender.send_json_to({"type": "message", "content": "hi", "client_msg_id": "abc"})
+    assert {(await sender.receive_json_from())["type"] for _ in range(2)} == {"chat.ack", "chat.message"}
+    await sender.send_json_to({"type": "message", "content": "hi", "client_msg_id": "abc"})
+    assert await sender.receive_json_from() == {
+        "type": "chat.ack", "client_msg_id": "abc", "seq": 1, "duplicate": True
+    }
+    await sender.send_json_to({"type": "message", "content": "again", "client_msg_id": "def"})
+    assert "retry_after" in await sender.receive_json_from()
+
+    await sender.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_saturated_writer_refuses_messages(monkeypatch, written_messages):
+    writer = SimpleNamespace(enqueue=lambda **fields: written_messages.append(fields) or True,
+                             saturated=True, flush_interval=0.5)
+    monkeypatch.setattr("chat.consumers.get_message_writer", lambda: writer)
+    sender = make_communicator(conversation_id="8")
+    await sender.connect()
+
+    await sender.send_json_to({"type": "message", "content": "hi"})
+    response = await sender.receive_json_from()
+    assert response["retry_after"] == 0.5
+    assert written_messages == []
+    assert await get_history_store().latest("chat_8") == []
+
+    await sender.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**IN_MEMORY_BACKENDS)
+async def test_read_acks_and_own_messages_move_the_watermark(read_acks):
+    client = make_communicator(conversation_id="8")
+    await client.connect()
+    for content in ["hi", "again"]:
+        await client.send_json_to({"type": "message", "content": content})
+        await client.receive_from()
+    await client.send_json_to({"type": "read", "seq": 1})
+    await client.send_json_to({"type": "read", "seq": "nope"})
+    await client.send_json_to({"type": "read", "seq": 10 ** 30})
+    await client.send_json_to({"type": "ping"})
+    await client.receive_from()
+    assert read_acks == [(1, 1), (1, 2), (1, 1), (1, 2)]
+    await client.disconnect()
+
+
+@pytest.mark.asyncio
+@override_settings(**{**IN_MEMORY_BACKENDS, "CHAT_RATE_LIMITER": {
+    "BACKEND": "chat.ratelimit.InMemoryRateLimiter",
+    "CONFIG": {"limits": {"message": {"rate": 0.001, "burst": 1}}},
+}})
+async def test_consumer_reports_metrics():
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    connections = sample("chat_ws_connections")
+    messages = sample("chat_ws_actions_total", action="message")
+    limited = sample("chat_ws_rate_limited_total", action="message")
+    deliveries = sample("chat_ws_delivery_seconds_count")
+    client = make_communicator(conversation_id="14")
+    await client.connect()
+    assert sample("chat_ws_connections") == connections + 1
+
+    await client.send_json_to({"type": "message", "content": "one"})
+    await client.receive_from()
+    await client.send_json_to({"type": "message", "content": "two"})
+    await client.receive_from()
+    assert sample("chat_ws_actions_total", action="message") == messages + 2
+    assert sample("chat_ws_rate_limited_total", action="message") == limited + 1
+    assert sample("chat_ws_delivery_seconds_count") == deliveries + 1
+    assert sample("chat_history_seconds_count", operation="append") >= 1
+
+    await client.disconnect()
+    assert sample("chat_ws_connections") == connections
@@ -0,0 +1,113 @@
+import pytest
+from django.test import override_settings
+from chat.history import InMemoryHistoryStore, RedisHistoryStore, get_history_store
+
+
+@pytest.mark.asyncio
+async def test_append_assigns_monotonic_seq():
+    store = InMemoryHistoryStore()
+    assert await store.append("chat_1", {"message": "a"}) == 1
+    assert await store.append("chat_1", {"message": "b"}) == 2
+    assert await store.append("chat_2", {"message": "c"}) == 1
+    assert await store.latest("chat_1") == [
+        {"seq": 1, "message": "a"},
+        {"seq": 2, "message": "b"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_append_trims_to_max_length():
+    store = InMemoryHistoryStore(max_length=3)
+    for i in range(5):
+        await store.append("chat_1", {"message": str(i)})
+    assert [entry["seq"] for entry in await store.latest("chat_1")] == [3, 4, 5]
+    assert [entry["seq"] for entry in await store.latest("chat_1", 2)] == [4, 5]
+
+
+@pytest.mark.asyncio
+async def test_reads_by_seq():
+    store = InMemoryHistoryStore(max_length=5)
+    for i in range(8):
+        await store.append("chat_1", {"message": str(i)})
+    assert [entry["seq"] for entry in await store.before("chat_1", 7, 2)] == [5, 6]
+    assert [entry["seq"] for entry in await store.before("chat_1", 5, 10)] == [4]
+    assert [entry["seq"] for entry in await store.after("chat_1", 6, 10)] == [7, 8]
+    assert await store.between("chat_1", 1, 3) == []
+
+
+
+@pytest.mark.asyncio
+async def test_append_once_dedupes_client_ids():
+    store = InMemoryHistoryStore(dedupe_ttl=60)
+    assert await store.append_once("chat_1", {"message": "a"}, "c1") == (1, True)
+    assert await store.append_once("chat_1", {"message": "a"}, "c1") == (1, False)
+    assert await store.append_once("chat_2", {"message": "a"}, "c1") == (1, True)
+    assert await store.append_once("chat_1", {"message": "b"}, "c2") == (2, True)
+    assert len(await store.latest("chat_1")) == 2
+    assert await store.client_msg_seq("chat_1", "c2") == 2
+    assert await store.client_msg_seq("chat_1", "c9") is None
+
+    store = InMemoryHistoryStore(dedupe_ttl=0)
+    assert await store.append_once("chat_1", {"message": "c"}, "c3") == (1, True)
+    assert await store.append_once("chat_1", {"message": "c"}, "c3") == (2, True)
+
+
+def test_client_msg_key_cannot_pose_as_a_counter():
+    store = RedisHistoryStore()
+    assert not store.client_msg_key("chat_1", "x:seq").endswith(":seq")
+    assert store.client_msg_key("chat_1", "a") != store.client_msg_key("chat_1", "b")
+
+
+@override_settings(CHAT_HISTORY={"BACKEND": "chat.history.InMemoryHistoryStore", "CONFIG": {"max_length": 10}})
+def test_store_follows_settings():
+    store = get_history_store()
+    assert isinstance(store, InMemoryHistoryStore)
+    assert store.max_length == 10
+
+
+class FakeArchive:
+    def __init__(self, entries):
+        self.entries = {entry["seq"]: entry for entry in entries}
+
+    async def between(self, group, low, high):
+        return [self.entries[seq] for seq in sorted(self.entries) if low <= seq <= high]
+
+    async def latest(self, group, limit):
+        return [self.entries[seq] for seq in sorted(self.entries)][-limit:]
+
+    async def last_seq(self, group):
+        return max(self.entries, default=0)
+
+
+@pytest.mark.asyncio
+async def test_reads_past_the_window_come_from_the_archive():
+    archive = FakeArchive([{"seq": seq, "message": str(seq)} for seq in range(1, 5)])
+    store = InMemoryHistoryStore(max_length=2, archive=archive)
+    for seq in range(5, 8):
+        await store.append("chat_1", {"message": str(seq)})
+        archive.entries[seq] = {"seq": seq, "message": str(seq)}
+
+    assert [entry["seq"] for entry in await store.latest("chat_1", 2)] == [6, 7]
+    assert [entry["seq"] for entry in await store.latest("chat_1", 4)] == [4, 5, 6, 7]
+    assert [entry["seq"] for entry in await store.before("chat_1", 7, 3)] == [4, 5, 6]
+    assert [entry["seq"] for entry in await store.after("chat_1", 2, 10)] == [3, 4, 5, 6, 7]
+    assert await store.after("chat_1", 7, 10) == []
+
+
+@pytest.mark.asyncio
+async def test_evicted_room_resumes_from_the_archive():
+    archive = FakeArchive([])
+    store = InMemoryHistoryStore(archive=archive)
+    for seq in range(1, 4):
+        await store.append("chat_1", {"message": str(seq)})
+
+    assert [group async for group in store.idle_rooms(3600)] == []
+    assert [group async for group in store.idle_rooms(0)] == ["chat_1"]
+    last_seq, entries = await store.snapshot("chat_1")
+    assert not await store.evict("chat_1", last_seq - 1)
+    archive.entries = {entry["seq"]: entry for entry in entries}
+    assert await store.evict("chat_1", last_seq)
+
+    assert [entry["seq"] for entry in await store.latest("chat_1", 2)] == [2, 3]
+    assert [entry["seq"] for entry in await store.after("chat_1", 1, 10)] == [2, 3]
+    assert await store.append("chat_1", {"message": "4"}) == 4
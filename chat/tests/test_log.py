@@ -0,0 +1,61 @@
+import io
+import json
+import logging
+from django.test import override_settings
+from pythonjsonlogger.json import JsonFormatter
+from chat.log import QueueLogHandler, log_event
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    records = Records()
+    logger.handlers = [records]
+    return logger, records.records
+
+
+@override_settings(CHAT_LOG_SAMPLING={"typing": 0.0, "read": 0.5})
+def test_log_event_samples_by_action(monkeypatch):
+    logger, records = make_logger("chat.tests.sampling")
+    log_event(logger, logging.INFO, "chat.action", action="typing", conversation="1", user=2)
+    log_event(logger, logging.DEBUG, "chat.action", action="message", conversation="1", user=2)
+    log_event(logger, logging.INFO, "chat.action", action="message", conversation="1", user=2)
+    monkeypatch.setattr("chat.log.random.random", lambda: 0.25)
+    log_event(logger, logging.INFO, "chat.action", action="read", conversation="1", user=2)
+
+    assert [(r.action, getattr(r, "sample_rate", None)) for r in records] == [("message", None), ("read", 0.5)]
+    assert records[0].getMessage() == "chat.action"
+    assert records[0].conversation == "1"
+
+
+def test_queue_handler_writes_json_off_thread():
+    stream = io.StringIO()
+    handler = QueueLogHandler(stream=stream, queue_size=1)
+    handler.setFormatter(JsonFormatter("%(levelname)s %(message)s"))
+    logger = logging.getLogger("chat.tests.queue")
+    logger.propagate = False
+    logger.handlers = [handler]
+    try:
+        logger.warning("chat.slow_consumer", extra={"conversation": "7"})
+    finally:
+        handler.listener.stop()
+
+    assert json.loads(stream.getvalue()) == {
+        "levelname": "WARNING", "message": "chat.slow_consumer", "conversation": "7",
+    }
+
+    # With the writer stopped and the queue full, records are dropped rather
+    # than blocking the caller.
+    logger.warning("first")
+    logger.warning("second")
+    assert handler.dropped == 1
@@ -0,0 +1,31 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import override_settings
+from chat.membership import get_membership_index
+from chat.models import Conversation, ConversationParticipant
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_MEMBERSHIP={"BACKEND": "chat.membership.InMemoryMembershipIndex"})
+def test_index_follows_participant_changes():
+    user = User.objects.create_user(username="alice@example.com", email="alice@example.com", password="pw")
+    conversation = Conversation.objects.create(owner=user)
+    index = get_membership_index()
+    is_member = async_to_sync(index.is_member)
+
+    assert not is_member(user.id, conversation.id)
+    participant = ConversationParticipant.objects.create(conversation=conversation, user=user)
+    assert is_member(user.id, conversation.id)
+    participant.delete()
+    assert not is_member(user.id, conversation.id)
+
+    # Invalidation waits for the commit, so nothing can cache the old rows
+    # under the new version in between.
+    with transaction.atomic():
+        ConversationParticipant.objects.create(conversation=conversation, user=user)
+        assert not is_member(user.id, conversation.id)
+    assert is_member(user.id, conversation.id)
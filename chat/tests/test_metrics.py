@@ -0,0 +1,26 @@
+from prometheus_client import REGISTRY
+from chat import metrics
+
+
+def rooms(size):
+    return REGISTRY.get_sample_value("chat_ws_rooms", {"size": size}) or 0
+
+
+def test_room_sizes_move_between_buckets():
+    sizes = metrics.RoomSizes()
+    before = {size: rooms(size) for size in ("le_1", "le_10")}
+    sizes.join("chat_a")
+    assert rooms("le_1") == before["le_1"] + 1
+    sizes.join("chat_a")
+    assert rooms("le_1") == before["le_1"]
+    assert rooms("le_10") == before["le_10"] + 1
+    sizes.leave("chat_a")
+    sizes.leave("chat_a")
+    assert rooms("le_1") == before["le_1"]
+    assert rooms("le_10") == before["le_10"]
+
+
+def test_unknown_actions_share_one_label():
+    assert metrics.action_label("message") == "message"
+    assert metrics.action_label("drop table") == "other"
+    assert metrics.action_label(None) == "other"
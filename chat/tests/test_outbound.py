@@ -0,0 +1,49 @@
+from unittest import mock
+from chat.outbound import RESYNC_FRAME, OutboundQueue
+
+
+def test_typing_frames_are_shed_before_messages():
+    queue = OutboundQueue(max_size=3, grace=10)
+    queue.put("chat.message", "m1")
+    queue.put("chat.typing", "t1")
+    queue.put("chat.message", "m2")
+    queue.put("chat.read", "r1")
+
+    assert queue.pop(10) == ["m1", "m2"]
+
+
+def test_history_pages_collapse_into_one_resync():
+    queue = OutboundQueue(max_size=2, grace=10)
+    queue.put("chat.history", "h1")
+    queue.put("chat.message", "m1")
+    queue.put("chat.history", "h2")
+    queue.put("chat.history", "h3")
+
+    assert queue.pop(10) == ["m1", RESYNC_FRAME]
+
+
+def test_disconnect_only_after_grace_period():
+    queue = OutboundQueue(max_size=1, grace=5)
+    with mock.patch("chat.outbound.time.monotonic", return_value=100.0):
+        queue.put("chat.message", "m1")
+        assert queue.put("chat.message", "m2") is False
+    # Draining the queue restarts the clock.
+    queue.pop(10)
+    with mock.patch("chat.outbound.time.monotonic", return_value=106.0):
+        assert queue.put("chat.message", "m3") is False
+        assert queue.put("chat.message", "m4") is False
+    with mock.patch("chat.outbound.time.monotonic", return_value=112.0):
+        assert queue.put("chat.message", "m5") is True
+
+
+def test_closing_queue_reports_once_and_discards_frames():
+    queue = OutboundQueue(max_size=1, grace=0)
+    with mock.patch("chat.outbound.time.monotonic", return_value=100.0):
+        queue.put("chat.message", "m1")
+        queue.put("chat.message", "m2")
+    with mock.patch("chat.outbound.time.monotonic", return_value=101.0):
+        assert queue.put("chat.message", "m3") is True
+        assert [queue.put("chat.message", f"m{n}") for n in range(4, 9)] == [False] * 5
+
+    assert queue.closing
+    assert queue.pop(10) == []
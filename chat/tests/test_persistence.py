@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from django.db import IntegrityError
+from prometheus_client import REGISTRY
+from channels.layers import InMemoryChannelLayer
+from chat.lifespan import lifespan
+from chat.persistence import MessageWriter
+from chat.receipts import ReadReceiptWriter
+
+
+class RecordingWriter(MessageWriter):
+    def __init__(self, failures=0, rejected=(), **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.failures = failures
+        self.rejected = set(rejected)
+
+    async def _bulk_create(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        if any(message.content in self.rejected for message in batch):
+            raise IntegrityError("conversation does not exist")
+        self.batches.append([message.content for message in batch])
+
+
+class RecordingReceipts(ReadReceiptWriter):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.writes = []
+
+    async def _upsert(self, pending):
+        self.writes.append(dict(pending))
+
+
+@pytest.mark.asyncio
+async def test_batches_by_count():
+    writer = RecordingWriter(batch_size=2, flush_interval=10)
+    for i in range(5):
+        writer.enqueue(conversation_id=1, sender_id=1, content=str(i))
+    await asyncio.sleep(0.01)
+    assert writer.batches == [["0", "1"], ["2", "3"]]
+    await writer.stop()
+    assert writer.batches[-1] == ["4"]
+    assert writer.written == 5
+
+
+@pytest.mark.asyncio
+async def test_batches_by_time():
+    writer = RecordingWriter(batch_size=100, flush_interval=0.01)
+    writer.enqueue(conversation_id=1, sender_id=1, content="hello")
+    await asyncio.sleep(0.05)
+    assert writer.batches == [["hello"]]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_retries_failed_batches():
+    writer = RecordingWriter(failures=2, batch_size=1, retry_delay=0)
+    writer.enqueue(conversation_id=1, sender_id=1, content="hello")
+    await asyncio.sleep(0.01)
+    assert writer.batches == [["hello"]]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_rejected_rows_do_not_sink_the_batch():
+    writer = RecordingWriter(rejected={"b"}, batch_size=3, flush_interval=10)
+    for content in "abc":
+        writer.enqueue(conversation_id=1, sender_id=1, content=content)
+    await writer.stop()
+    assert writer.batches == [["a"], ["c"]]
+    assert (writer.written, writer.dropped) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_sheds_when_queue_is_full():
+    writer = RecordingWriter(max_queue_size=1, flush_interval=10)
+    assert writer.enqueue(conversation_id=1, sender_id=1, content="a")
+    dropped = REGISTRY.get_sample_value("chat_messages_dropped_total", {"reason": "queue_full"}) or 0
+    assert writer.saturated
+    assert not writer.enqueue(conversation_id=1, sender_id=1, content="b")
+    assert writer.dropped == 1
+    assert REGISTRY.get_sample_value("chat_messages_dropped_total", {"reason": "queue_full"}) == dropped + 1
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_shutdown_drains_writers(monkeypatch):
+    writer = RecordingWriter(batch_size=100, flush_interval=10)
+    receipts = RecordingReceipts(flush_interval=10)
+    monkeypatch.setattr("chat.lifespan.get_message_writer", lambda: writer)
+    monkeypatch.setattr("chat.lifespan.get_read_receipts", lambda: receipts)
+    monkeypatch.setattr("chat.receipts.get_channel_layer", lambda: InMemoryChannelLayer())
+    writer.enqueue(conversation_id=1, sender_id=1, content="hello")
+    receipts.ack(1, "1", "chat_1", 4)
+
+    events = asyncio.Queue()
+    for message_type in ("lifespan.startup", "lifespan.shutdown"):
+        events.put_nowait({"type": message_type})
+    sent = []
+
+    async def send(message):
+        sent.append(message["type"])
+
+    await lifespan({"type": "lifespan"}, events.get, send)
+
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert writer.batches == [["hello"]]
+    assert receipts.writes == [{(1, 1): 4}]
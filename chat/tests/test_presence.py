@@ -0,0 +1,23 @@
+import pytest
+from chat.presence import InMemoryPresenceStore
+
+
+@pytest.mark.asyncio
+async def test_online_is_per_user_across_sockets():
+    store = InMemoryPresenceStore()
+    await store.touch("1", 7, "channel-a")
+    await store.touch("1", 7, "channel-b")
+    await store.touch("2", 8, "channel-c")
+    assert await store.online(["1", "2", "3"]) == {"1": [7], "2": [8], "3": []}
+
+    await store.leave("1", 7, "channel-a")
+    assert (await store.online(["1"]))["1"] == [7]
+    await store.leave("1", 7, "channel-b")
+    assert (await store.online(["1"]))["1"] == []
+
+
+@pytest.mark.asyncio
+async def test_stale_sockets_are_swept():
+    store = InMemoryPresenceStore(timeout=0)
+    await store.touch("1", 7, "channel-a")
+    assert await store.online(["1"]) == {"1": []}
@@ -0,0 +1,24 @@
+import pytest
+from chat.ratelimit import InMemoryRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_limits_are_per_action():
+    limiter = InMemoryRateLimiter(limits={"message": {"rate": 1, "burst": 2}})
+    assert (await limiter.allow("message", 1))[0]
+    assert (await limiter.allow("message", 1))[0]
+    allowed, retry_after = await limiter.allow("message", 1)
+    assert not allowed
+    assert 0 < retry_after <= 1
+    assert (await limiter.allow("message", 2))[0]
+    assert (await limiter.allow("typing", 1)) == (True, 0.0)
+
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_refilled_buckets():
+    limiter = InMemoryRateLimiter(limits={"message": {"rate": 1000, "burst": 1}})
+    for user_id in range(10):
+        await limiter.allow("message", user_id)
+    assert len(limiter) == 10
+    limiter.sweep(now=float("inf"))
+    assert len(limiter) == 0
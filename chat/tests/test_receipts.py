@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pytest
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from chat.models import Conversation, ReadReceipt
+from chat.receipts import ReadReceiptWriter
+
+User = get_user_model()
+
+
+class RecordingReceipts(ReadReceiptWriter):
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.writes = []
+        self.failures = failures
+
+    async def _upsert(self, pending):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        self.writes.append(dict(pending))
+
+
+@pytest.mark.asyncio
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+async def test_acks_coalesce_into_one_write_and_fanout():
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add("chat_1", channel)
+    receipts = RecordingReceipts(flush_interval=10)
+
+    for seq in [3, 5, 4]:
+        receipts.ack(1, "1", "chat_1", seq)
+    receipts.ack(2, "1", "chat_1", 2)
+    receipts.ack(1, "2", "chat_2", 7)
+    await receipts.stop()
+
+    assert receipts.writes == [{(1, 1): 5, (2, 1): 2, (1, 2): 7}]
+    event = await asyncio.wait_for(channel_layer.receive(channel), 1)
+    assert json.loads(event["text"]) == {
+        "type": "chat.read",
+        "receipts": [{"user_id": 1, "seq": 5}, {"user_id": 2, "seq": 2}],
+    }
+
+
+@pytest.mark.asyncio
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+async def test_failed_write_is_retried_with_newer_acks():
+    receipts = RecordingReceipts(failures=1, flush_interval=10)
+    receipts.ack(1, "1", "chat_1", 3)
+    await receipts.flush()
+    receipts.ack(1, "1", "chat_1", 2)
+    await receipts.stop()
+    assert receipts.writes == [{(1, 1): 3}]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_watermark_never_moves_back():
+    user = User.objects.create_user(username="alice@example.com", email="alice@example.com", password="pw")
+    conversation = Conversation.objects.create(owner=user)
+    upsert = async_to_sync(ReadReceiptWriter()._upsert)
+
+    upsert({(user.id, conversation.id): 5})
+    upsert({(user.id, conversation.id): 3})
+    assert ReadReceipt.objects.get(user=user, conversation=conversation).last_read_seq == 5
+    upsert({(user.id, conversation.id): 9})
+    assert ReadReceipt.objects.get(user=user, conversation=conversation).last_read_seq == 9
+
+
+@pytest.mark.asyncio
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+async def test_lower_ack_after_a_flush_is_not_rebroadcast():
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add("chat_1", channel)
+    receipts = RecordingReceipts(flush_interval=10)
+
+    receipts.ack(1, "1", "chat_1", 5)
+    await receipts.flush()
+    receipts.ack(1, "1", "chat_1", 3)
+    await receipts.stop()
+
+    assert receipts.writes == [{(1, 1): 5}]
+    await asyncio.wait_for(channel_layer.receive(channel), 1)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(channel_layer.receive(channel), 0.05)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rejected_receipt_does_not_hold_back_the_rest():
+    user = User.objects.create_user(username="alice@example.com", email="alice@example.com", password="pw")
+    conversation = Conversation.objects.create(owner=user)
+    receipts = ReadReceiptWriter()
+
+    async def flush():
+        receipts._pending = {(user.id, conversation.id): 4, (user.id, conversation.id + 1): 2}
+        await receipts.flush()
+
+    async_to_sync(flush)()
+    assert list(ReadReceipt.objects.values_list("conversation_id", "last_read_seq")) == [(conversation.id, 4)]
+    assert receipts.pending == 0
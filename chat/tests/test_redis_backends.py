@@ -0,0 +1,119 @@
+import fakeredis
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from chat.history import RedisHistoryStore
+from chat.membership import RedisMembershipIndex
+from chat.models import Conversation, ConversationParticipant
+from chat.presence import RedisPresenceStore
+from chat.ratelimit import RedisRateLimiter
+
+User = get_user_model()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """
+    Point every Redis backend at one in-process server, so the Lua
+    scripts run as they would against Redis.
+    """
+    server = fakeredis.FakeServer()
+    for module in ("history", "membership", "presence", "ratelimit"):
+        monkeypatch.setattr(f"chat.{module}.get_redis", lambda: fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr("django_redis.get_redis_connection", lambda alias: fakeredis.FakeRedis(server=server))
+    return fakeredis.FakeRedis(server=server)
+
+
+class Archive:
+    def __init__(self, last_seq=0):
+        self._last_seq = last_seq
+
+    async def last_seq(self, group):
+        return self._last_seq
+
+
+@pytest.mark.asyncio
+async def test_history_appends_trims_and_reads_by_seq(redis):
+    store = RedisHistoryStore(max_length=3, max_age=60)
+    for seq in range(1, 6):
+        assert await store.append("chat_1", {"message": str(seq)}) == seq
+
+    assert await store.latest("chat_1") == [{"seq": seq, "message": str(seq)} for seq in (3, 4, 5)]
+    assert await store.window("chat_1", 2, 4) == (3, [{"seq": 3, "message": "3"}, {"seq": 4, "message": "4"}])
+    assert await store.window("chat_2", 1, 4) == (None, [])
+    assert await store.last_seq("chat_1") == 5
+    assert 0 < redis.ttl(store.messages_key("chat_1")) <= 60
+    assert 0 < redis.ttl(store.seq_key("chat_1")) <= 60
+
+
+@pytest.mark.asyncio
+async def test_history_dedupes_client_ids(redis):
+    store = RedisHistoryStore(dedupe_ttl=60, max_age=60)
+    assert await store.append_once("chat_1", {"message": "a"}, "c1:seq") == (1, True)
+    assert await store.append_once("chat_1", {"message": "a"}, "c1:seq") == (1, False)
+    assert await store.append_once("chat_1", {"message": "b"}, "c2") == (2, True)
+    assert await store.client_msg_seq("chat_1", "c1:seq") == 1
+    assert await store.client_msg_seq("chat_2", "c1:seq") is None
+    assert len(await store.latest("chat_1")) == 2
+    # Only the room counter looks like a room to the eviction scan.
+    assert [group async for group in store.idle_rooms(0)] == ["chat_1"]
+
+
+@pytest.mark.asyncio
+async def test_history_seeds_counter_and_evicts_only_unchanged_rooms(redis):
+    store = RedisHistoryStore(archive=Archive(last_seq=41))
+    assert await store.append("chat_1", {"message": "a"}) == 42
+    assert await store.append_once("chat_2", {"message": "b"}, "c1") == (42, True)
+
+    last_seq, entries = await store.snapshot("chat_1")
+    assert (last_seq, entries) == (42, [{"seq": 42, "message": "a"}])
+    await store.append("chat_1", {"message": "c"})
+    assert not await store.evict("chat_1", last_seq)
+    assert await store.evict("chat_1", 43)
+    assert await store.snapshot("chat_1") == (0, [])
+    assert await store.append("chat_1", {"message": "d"}) == 42
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_buckets_per_user_and_action(redis):
+    limiter = RedisRateLimiter(limits={"message": {"rate": 1, "burst": 2}})
+    assert (await limiter.allow("message", 1))[0]
+    assert (await limiter.allow("message", 1))[0]
+    allowed, retry_after = await limiter.allow("message", 1)
+    assert not allowed and 0 < retry_after <= 1
+    assert (await limiter.allow("message", 2))[0]
+    assert await limiter.allow("typing", 1) == (True, 0.0)
+
+
+@pytest.mark.asyncio
+async def test_presence_tracks_connections(redis):
+    store = RedisPresenceStore(timeout=60)
+    await store.touch("1", 7, "channel-a")
+    await store.touch("1", 7, "channel-b")
+    await store.touch("1", 8, "channel-c")
+    await store.leave("1", 7, "channel-a")
+    await store.leave("1", 8, "channel-c")
+
+    assert await store.online(["1", "2"]) == {"1": [7], "2": []}
+    assert 0 < redis.ttl(store.key("1")) <= 120
+
+
+@pytest.mark.django_db(transaction=True)
+def test_membership_fills_from_the_database_and_invalidates(redis):
+    user = User.objects.create_user(username="alice@example.com", email="alice@example.com", password="pw")
+    conversation = Conversation.objects.create(owner=user)
+    index = RedisMembershipIndex()
+    conversations = async_to_sync(index.conversations)
+
+    assert conversations(user.id) == set()
+    # The empty result is cached too, so an add lands in a loaded set.
+    assert redis.smembers(index.keys(user.id)[0]) == {b"-"}
+    index.add(user.id, conversation.id)
+    assert async_to_sync(index.is_member)(user.id, str(conversation.id))
+
+    index.invalidate(user.id)
+    assert not redis.exists(index.keys(user.id)[0])
+    assert not async_to_sync(index.is_member)(user.id, str(conversation.id))
+    ConversationParticipant.objects.create(conversation=conversation, user=user)
+    index.invalidate(user.id)
+    assert conversations(user.id) == {conversation.id}
@@ -0,0 +1,19 @@
+import asyncio
+import logging
+import pytest
+from chat.tasks import spawn
+
+
+@pytest.mark.asyncio
+async def test_spawn_holds_tasks_and_logs_failures(caplog):
+    async def fail():
+        raise RuntimeError("boom")
+
+    tasks = set()
+    task = spawn(fail(), tasks)
+    assert tasks == {task}
+    with caplog.at_level(logging.ERROR, logger="chat.tasks"):
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+    assert tasks == set()
+    assert "fail" in caplog.text and "boom" in caplog.text
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import pytest
+from channels.layers import get_channel_layer
+from django.test import override_settings
+from chat.typing_indicators import TypingTracker
+
+
+async def drain(channel_layer, channel):
+    events = []
+    while True:
+        try:
+            event = await asyncio.wait_for(channel_layer.receive(channel), 0.05)
+        except asyncio.TimeoutError:
+            return events
+        events.append(json.loads(event["text"]))
+
+
+@pytest.mark.asyncio
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+async def test_only_transitions_are_broadcast():
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add("chat_1", channel)
+    tracker = TypingTracker(ttl=10, min_interval=0.01)
+
+    for _ in range(5):
+        tracker.typing("chat_1", 1, "alice")
+    tracker.typing("chat_1", 2, "bob")
+    await asyncio.sleep(0.03)
+    assert await drain(channel_layer, channel) == [{
+        "type": "chat.typing",
+        "started": [{"user": "alice", "user_id": 1}, {"user": "bob", "user_id": 2}],
+        "stopped": [],
+    }]
+
+    tracker.typing("chat_1", 1, "alice")
+    tracker.stop_typing("chat_1", 2)
+    tracker.stop_typing("chat_1", 2)
+    tracker.typing("chat_1", 3, "carol")
+    await asyncio.sleep(0.03)
+    assert await drain(channel_layer, channel) == [{
+        "type": "chat.typing",
+        "started": [{"user": "carol", "user_id": 3}],
+        "stopped": [{"user": "bob", "user_id": 2}],
+    }]
+
+
+@pytest.mark.asyncio
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+async def test_typing_expires_after_ttl():
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    await channel_layer.group_add("chat_1", channel)
+    tracker = TypingTracker(ttl=0.05, min_interval=0.01)
+
+    tracker.typing("chat_1", 1, "alice")
+    await asyncio.sleep(0.1)
+    assert [(len(event["started"]), len(event["stopped"])) for event in await drain(channel_layer, channel)] == [
+        (1, 0), (0, 1),
+    ]
+    assert not tracker.is_typing("chat_1", 1)
@@ -0,0 +1,162 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.urls import reverse
+from chat.models import Conversation, ConversationParticipant, Message, ReadReceipt
+from chat.pagination import encode_cursor
+from chat.search import message_vector
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def in_memory_backends(settings):
+    settings.CHAT_MEMBERSHIP = {"BACKEND": "chat.membership.InMemoryMembershipIndex"}
+
+
+@pytest.fixture
+def conversation(db):
+    owner = User.objects.create_user(username="alice@example.com", email="alice@example.com", first_name="alice", password="pw")
+    conversation = Conversation.objects.create(owner=owner, title="general")
+    ConversationParticipant.objects.create(conversation=conversation, user=owner)
+    return conversation
+
+
+def test_conversation_messages_pages_back_by_keyset(client, conversation):
+    Message.objects.bulk_create(
+        [Message(conversation=conversation, sender=conversation.owner, content=str(i)) for i in range(5)]
+    )
+    client.force_login(conversation.owner)
+    url = reverse("api_conversation_messages", args=[conversation.id])
+
+    response = client.get(url, {"limit": 2}).json()
+    assert [msg["content"] for msg in response["messages"]] == ["3", "4"]
+
+    response = client.get(url, {"limit": 2, "before": response["next_cursor"]}).json()
+    assert [msg["content"] for msg in response["messages"]] == ["1", "2"]
+
+    response = client.get(url, {"limit": 2, "before": response["next_cursor"]}).json()
+    assert [msg["content"] for msg in response["messages"]] == ["0"]
+    assert response["next_cursor"] is None
+
+
+def test_conversation_messages_rejects_malformed_cursor(client, conversation):
+    client.force_login(conversation.owner)
+    url = reverse("api_conversation_messages", args=[conversation.id])
+    for values in (["2024-01-01T00:00:00+00:00", "x"], ["2024-01-01T00:00:00+00:00", None], ["nope", 1]):
+        response = client.get(url, {"before": encode_cursor(*values)})
+        assert response.status_code == 400
+
+
+def test_conversation_messages_requires_participant(client, conversation):
+    outsider = User.objects.create_user(username="bob@example.com", email="bob@example.com", password="pw")
+    client.force_login(outsider)
+    response = client.get(reverse("api_conversation_messages", args=[conversation.id]))
+    assert response.status_code == 403
+
+
+def test_conversation_list_is_one_query(client, conversation, django_assert_num_queries):
+    other = User.objects.create_user(username="bob@example.com", email="bob@example.com", first_name="bob", password="pw")
+    second = Conversation.objects.create(owner=other, title="random")
+    ConversationParticipant.objects.create(conversation=second, user=conversation.owner)
+    Message.objects.create(conversation=conversation, sender=other, content="hi alice", seq=1)
+    Message.objects.create(conversation=conversation, sender=other, content="are you there?", seq=2)
+    Message.objects.create(conversation=conversation, sender=conversation.owner, content="hi bob", seq=3)
+    ReadReceipt.objects.create(user=conversation.owner, conversation=conversation, last_read_seq=1)
+    url = reverse("api_conversations")
+    client.post(url, {"user_id": conversation.owner.id}, content_type="application/json")
+
+    with django_assert_num_queries(1):
+        response = client.post(url, {"user_id": conversation.owner.id}, content_type="application/json")
+
+    by_title = {item["title"]: item for item in response.json()}
+    assert by_title["general"]["last_message"]["message"] == "hi bob"
+    assert by_title["general"]["unread_count"] == 2
+    assert by_title["random"]["last_message"] is None
+    assert by_title["random"]["unread_count"] == 0
+    assert by_title["random"]["owner"]["email"] == "bob@example.com"
+
+
+def test_create_conversation_adds_all_participants(client, conversation, django_assert_max_num_queries):
+    emails = [f"user{i}@example.com" for i in range(20)]
+    User.objects.bulk_create([User(username=email, email=email) for email in emails])
+    url = reverse("api_create_conv")
+    payload = {"user_id": conversation.owner.id, "title": "big room", "conversation_participants": ",".join(emails)}
+
+    with django_assert_max_num_queries(8):
+        response = client.post(url, payload, content_type="application/json")
+
+    assert response.status_code == 201
+    created = Conversation.objects.get(id=response.json()["id"])
+    assert created.participants.count() == 21
+
+
+def test_create_conversation_reports_unknown_emails(client, conversation):
+    url = reverse("api_create_conv")
+    payload = {
+        "user_id": conversation.owner.id,
+        "conversation_participants": "alice@example.com,ghost@example.com,nobody@example.com",
+    }
+    response = client.post(url, payload, content_type="application/json")
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "conversation_participants": ["No user with email ghost@example.com.", "No user with email nobody@example.com."]
+    }
+    assert Conversation.objects.count() == 1
+
+
+def test_user_directory_pages_and_searches(client, conversation):
+    User.objects.bulk_create(
+        [User(username=f"user{i}@example.com", email=f"user{i}@example.com", first_name=f"name{i}") for i in range(3)]
+    )
+    url = reverse("api_get_all_users")
+
+    response = client.get(url, {"limit": 2}).json()
+    assert [user["email"] for user in response["results"]] == ["alice@example.com", "user0@example.com"]
+    assert set(response["results"][0]) == {"id", "email", "first_name", "last_name"}
+    response = client.get(url, {"limit": 2, "cursor": response["next_cursor"]}).json()
+    assert [user["email"] for user in response["results"]] == ["user1@example.com", "user2@example.com"]
+    assert response["next_cursor"] is None
+
+    response = client.get(url, {"q": "NAME2"}).json()
+    assert [user["email"] for user in response["results"]] == ["user2@example.com"]
+
+
+def test_user_directory_etag_tracks_changes(client, conversation):
+    url = reverse("api_get_all_users")
+    etag = client.get(url)["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    User.objects.create_user(username="bob@example.com", email="bob@example.com", password="pw")
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+def test_search_requires_a_query(client, conversation):
+    client.force_login(conversation.owner)
+    assert client.get(reverse("api_search")).status_code == 400
+    client.logout()
+    assert client.get(reverse("api_search"), {"q": "hello"}).status_code == 401
+
+
+@pytest.mark.skipif(connection.vendor != "postgresql", reason="full-text search needs Postgres")
+def test_search_ranks_highlights_and_pages(client, conversation):
+    other = Conversation.objects.create(owner=conversation.owner, title="not mine")
+    contents = ["deploy <b>deploy</b> deploy", "deploy tonight", "lunch?", "the deploy went fine"]
+    Message.objects.bulk_create(
+        [Message(conversation=conversation, sender=conversation.owner, content=content, search_vector=message_vector(content))
+         for content in contents]
+        + [Message(conversation=other, sender=conversation.owner, content="deploy", search_vector=message_vector("deploy"))]
+    )
+    ConversationParticipant.objects.filter(conversation=other).delete()
+    client.force_login(conversation.owner)
+
+    response = client.get(reverse("api_search"), {"q": "deploys", "limit": 2}).json()
+    top = response["results"][0]
+    assert top["headline"].startswith("<mark>deploy</mark>")
+    assert "<b>" not in top["headline"]
+    seen = [hit["id"] for hit in response["results"]]
+    response = client.get(reverse("api_search"), {"q": "deploys", "limit": 2, "cursor": response["next_cursor"]}).json()
+    seen += [hit["id"] for hit in response["results"]]
+    assert response["next_cursor"] is None
+    assert len(seen) == len(set(seen)) == 3
@@ -0,0 +1,122 @@
+import asyncio
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from . import encoding
+from .tasks import spawn
+
+
+class TypingTracker:
+    """
+    Coalesces typing indicators per room before they are broadcast.
+
+    Consumers report every ``typing``/``stop_typing`` event, but the room only
+    hears about state transitions: a user starting to type, or stopping
+    (explicitly or because no ``typing`` arrived for ``ttl`` seconds).
+    Transitions are flushed at most once every ``min_interval`` seconds per
+    room, as a single ``chat.typing`` frame listing who ``started`` and who
+    ``stopped``, so however many users type at once a room gets at most one
+    fanout per interval. The tracker is per process, so the frames carry
+    changes rather than the full set of typists: each worker only knows
+    about its own sockets.
+    """
+
+    def __init__(self, ttl=6.0, min_interval=0.25):
+        self.ttl = ttl
+        self.min_interval = min_interval
+        # group -> {user_id: (first_name, expires_at)}
+        self._typing = {}
+        # group -> {user_id: first_name} as last broadcast to the room
+        self._announced = {}
+        self._last_flush = {}
+        self._timers = {}
+        self._flushes = set()
+
+    def is_typing(self, group, user_id):
+        return user_id in self._announced.get(group, {})
+
+    def typing(self, group, user_id, name):
+        loop = asyncio.get_running_loop()
+        self._typing.setdefault(group, {})[user_id] = (name, loop.time() + self.ttl)
+        self._schedule(group, loop)
+
+    def stop_typing(self, group, user_id):
+        if self._typing.get(group, {}).pop(user_id, None) is not None or self.is_typing(group, user_id):
+            self._schedule(group, asyncio.get_running_loop())
+
+    def clear(self, group, user_id):
+        """
+        Forget a user's typing state without announcing it, e.g. after they
+        sent a message, which clients already treat as the end of typing.
+        """
+        self._typing.get(group, {}).pop(user_id, None)
+        self._announced.get(group, {}).pop(user_id, None)
+
+    def _schedule(self, group, loop, delay=None):
+        if delay is None:
+            delay = max(0.0, self._last_flush.get(group, 0.0) + self.min_interval - loop.time())
+        timer = self._timers.get(group)
+        if timer is not None:
+            if timer.when() <= loop.time() + delay:
+                return
+            timer.cancel()
+        self._timers[group] = loop.call_later(delay, lambda: spawn(self._flush(group), self._flushes))
+
+    async def _flush(self, group):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._timers.pop(group, None)
+        self._last_flush[group] = now
+
+        typing = self._typing.get(group, {})
+        for user_id, (_, expires_at) in list(typing.items()):
+            if expires_at <= now:
+                del typing[user_id]
+        current = {user_id: name for user_id, (name, _) in typing.items()}
+        announced = self._announced.get(group, {})
+
+        stopped = [
+            {'user': name, 'user_id': user_id}
+            for user_id, name in announced.items() if user_id not in current
+        ]
+        started = [
+            {'user': name, 'user_id': user_id}
+            for user_id, name in current.items() if user_id not in announced
+        ]
+
+        if current:
+            self._announced[group] = current
+            next_expiry = min(expires_at for _, expires_at in typing.values())
+            self._schedule(group, loop, delay=max(next_expiry - now, self.min_interval))
+        else:
+            self._typing.pop(group, None)
+            self._announced.pop(group, None)
+            self._last_flush.pop(group, None)
+
+        if started or stopped:
+            await get_channel_layer().group_send(group, encoding.event({
+                'type': 'chat.typing',
+                'started': started,
+                'stopped': stopped,
+            }))
+
+
+_tracker = None
+
+
+def get_typing_tracker():
+    """
+    Return the process-wide tracker configured by ``CHAT_TYPING``.
+    """
+    global _tracker
+    if _tracker is None:
+        _tracker = TypingTracker(**getattr(settings, "CHAT_TYPING", {}))
+    return _tracker
+
+
+@receiver(setting_changed)
+def _reset_typing_tracker(setting, **kwargs):
+    global _tracker
+    if setting == "CHAT_TYPING":
+        _tracker = None
@@ -16,5 +16,8 @@ urlpatterns = [
     path("api/users/", chat_views.get_all_users, name="api_get_all_users"),
     path("api/conversations/", chat_views.conversation_list, name="api_conversations"),
     path("api/conversations/create/", chat_views.create_conversation, name="api_create_conv"),
+    path("api/conversations/<int:conversation_id>/messages/", chat_views.conversation_messages, name="api_conversation_messages"),
+    path("api/presence/", chat_views.presence, name="api_presence"),
+    path("api/search/", chat_views.search_messages, name="api_search"),
 ] 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
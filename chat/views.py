@@ -1,7 +1,16 @@
 import json
 import logging
+from asgiref.sync import async_to_sync
 from datetime import datetime, timezone
+from django.conf import settings
+from django.db import transaction
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, FloatField, IntegerField, JSONField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce, Greatest, JSONObject
+from django.utils.html import escape
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import render, redirect
+from django.views.decorators.http import etag
 from django.http import JsonResponse, HttpResponseForbidden
 from django.contrib.auth import logout, login, authenticate
 from rest_framework.decorators import api_view, permission_classes
@@ -11,8 +20,13 @@ from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.views import APIView
 from rest_framework import status, permissions
-from .models import User, Conversation, Message, ConversationParticipant
-from .serializers import UserSerializer, ConversationSerializer, MessageSerializer, ConversationParticipantSerializer, ConversationCreateSerializer
+from .models import User, Conversation, Message, ConversationParticipant, ReadReceipt
+from .serializers import UserSerializer, ConversationSerializer, MessageSerializer, ConversationCreateSerializer, MessagePageSerializer, ConversationListSerializer
+from .directory import directory_etag
+from .membership import get_membership_index
+from .presence import get_presence_store
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, page_limit
+from .search import SEARCH_CONFIG
 from .forms import SignUpForm
 
 
@@ -20,11 +34,11 @@ logger = logging.getLogger(__name__)
 
 # ---------- Front‑end Views ----------
 def home(request):  
-    logger.info("home request", request)
+    logger.info("home request")
     return render(request, "home.html")
 
 def signup(request):
-    logger.info("signup request", request)
+    logger.info("signup request")
     if request.method == "POST":
         form = SignUpForm(request.POST)
         if form.is_valid():
@@ -36,7 +50,7 @@ def signup(request):
     return render(request, "signup.html", {"form": form})
 
 def login_view(request):
-    logger.info("login_view request", request)
+    logger.info("login_view request")
     if request.method == "POST":
         raw_body = request.body
         decoded_body = raw_body.decode('utf-8')
@@ -61,7 +75,7 @@ def login_view(request):
     return render(request, "login.html")
 
 def logout_view(request):
-    logger.info("logout_view request", request)
+    logger.info("logout_view request")
     logout(request)
     response = redirect("home")
     response.delete_cookie("access_token")
@@ -69,41 +83,94 @@ def logout_view(request):
     return response
 
 def chat(request):
-    logger.info("chat request", request)
+    logger.info("chat request")
     return render(request, "chat_list.html")
 
 # ---------- API Views ----------
 def user_detail(request):
-    logger.info("user_detail request", request)
+    logger.info("user_detail request")
     serializer = UserSerializer(request.user)
     return Response(serializer.data)
 
+@etag(directory_etag)
 def get_all_users(request):
-    logger.info("get_all_users request", request)
-    users = User.objects.all()
-    serializer = UserSerializer(users, many=True)   
-    return JsonResponse(serializer.data, safe=False, status=status.HTTP_200_OK)
+    """
+    Return one page of the user directory, optionally filtered by a
+    case-insensitive prefix of the email or first name (``q``).
+
+    Pages are keyed on id; unchanged pages are answered with 304 through the
+    directory version in the ETag.
+    """
+    logger.info("get_all_users request")
+    limit = page_limit(request.GET.get("limit"), settings.CHAT_DIRECTORY_PAGE_SIZE, settings.CHAT_DIRECTORY_MAX_PAGE_SIZE)
+    users = User.objects.order_by("id")
+    query = request.GET.get("q", "").strip()
+    if query:
+        users = users.filter(Q(email__istartswith=query) | Q(first_name__istartswith=query))
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            (after_id,) = decode_cursor(cursor)
+            users = users.filter(id__gt=int(after_id))
+        except (InvalidCursor, TypeError, ValueError):
+            return JsonResponse({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+    page = list(users.values("id", "email", "first_name", "last_name")[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]["id"])
+    return JsonResponse({"results": page, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
  
 def conversation_list(request):
     """Return list of conversations for the logged‑in user."""
     if request.method == "POST":
-        logger.info("conversation_list request", request)
-        conversations = []
+        logger.info("conversation_list request")
         raw_body = request.body
         decoded_body = raw_body.decode('utf-8')
         data = json.loads(decoded_body)
         user_id = data.get("user_id")
-        user = User.objects.get(id=user_id)
- 
-        conversations_participants = ConversationParticipant.objects.filter(user=user) 
 
-        for conversation in conversations_participants:
-            conversation_instance = Conversation.objects.get(id=conversation.conversation.id)   
-            conversation_serializer = ConversationSerializer(conversation_instance)
-            conversations.append(conversation_serializer.data)
+        # One query: the caller's participations joined to each conversation
+        # and its owner, with the latest message and the caller's read
+        # watermark as single-row subqueries. The unread count is the gap
+        # between the two sequence numbers, so no messages are counted.
+        latest_messages = Message.objects.filter(conversation=OuterRef("conversation_id")).order_by("-timestamp", "-id")
+        last_message = latest_messages.values(
+            json=JSONObject(
+                id="id",
+                seq="seq",
+                user="sender__first_name",
+                user_id="sender_id",
+                message="content",
+                timestamp="timestamp",
+            )
+        )[:1]
+        last_seq = latest_messages.values("seq")[:1]
+        last_read_seq = ReadReceipt.objects.filter(
+            user_id=OuterRef("user_id"), conversation=OuterRef("conversation_id")
+        ).values("last_read_seq")[:1]
+        participations = (
+            ConversationParticipant.objects.filter(user_id=user_id)
+            .select_related("conversation__owner")
+            .annotate(
+                last_message=Subquery(last_message, output_field=JSONField()),
+                unread_count=Greatest(
+                    Coalesce(Subquery(last_seq), 0) - Coalesce(Subquery(last_read_seq), 0),
+                    0,
+                    output_field=IntegerField(),
+                ),
+            )
+        )
 
-        serializer = ConversationSerializer(conversations, many=True)
+        conversations = []
+        for participation in participations:
+            conversation = participation.conversation
+            conversation.last_message = participation.last_message
+            conversation.unread_count = participation.unread_count
+            conversations.append(conversation)
+        serializer = ConversationListSerializer(conversations, many=True)
 
         return JsonResponse(serializer.data, safe=False, status=status.HTTP_200_OK)
 
@@ -111,7 +178,7 @@ def conversation_list(request):
 def create_conversation(request):
     """Create a conversation with the supplied participants."""
     if request.method == "POST":
-        logger.info("create_conversation request", request)
+        logger.info("create_conversation request")
         raw_body = request.body
         decoded_body = raw_body.decode('utf-8')
         data = json.loads(decoded_body)
@@ -123,40 +190,160 @@ def create_conversation(request):
             "owner": UserSerializer(user).data,  
         }
         conversation_serializer = ConversationCreateSerializer(data=conversation_data)
-        if conversation_serializer.is_valid():
-            conv = conversation_serializer.save()
-            conv.save()
-            conversation_id = conv.id
-            conversation_participants = data.get("conversation_participants")
-            conversation_participants = conversation_participants.split(",")
-            conversation_participants = [User.objects.get(email=participant) for participant in conversation_participants]
-            conversation_participants.append(user)
-
-            for participant in conversation_participants:
-                conversation_instance = Conversation.objects.get(id=conversation_id)
-                user_instance = User.objects.get(id=participant.id)
-
-                conversation_participant_data = {
-                    "conversation": ConversationSerializer(conversation_instance).data,
-                    "user": UserSerializer(user_instance).data,
-                }
-                conversation_participant_serializer = ConversationParticipantSerializer(data=conversation_participant_data)
-
-                if conversation_participant_serializer.is_valid():
-                    conversation_participant_serializer.save() 
-                else:
-                    logger.error("create_conversation conversation_participant_serializer errors", conversation_participant_serializer.errors)
-            
-            return JsonResponse(conversation_serializer.data, safe=False, status=status.HTTP_201_CREATED)
-        return JsonResponse(conversation_serializer.errors, safe=False, status=status.HTTP_400_BAD_REQUEST)
+        if not conversation_serializer.is_valid():
+            return JsonResponse(conversation_serializer.errors, safe=False, status=status.HTTP_400_BAD_REQUEST)
+
+        emails = {email.strip() for email in (data.get("conversation_participants") or "").split(",") if email.strip()}
+        participants = User.objects.filter(email__in=emails).only("id", "email")
+        unknown_emails = sorted(emails - {participant.email for participant in participants})
+        if unknown_emails:
+            return JsonResponse(
+                {"conversation_participants": [f"No user with email {email}." for email in unknown_emails]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        member_ids = {user.id} | {participant.id for participant in participants}
+
+        with transaction.atomic():
+            conv = Conversation.objects.create(owner=user, title=conversation_serializer.validated_data.get("title"))
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(conversation=conv, user_id=member_id) for member_id in member_ids]
+            )
+            # bulk_create sends no post_save, so update the index ourselves.
+            transaction.on_commit(lambda: get_membership_index().add_members(conv.id, member_ids))
+
+        return JsonResponse(ConversationCreateSerializer(conv).data, safe=False, status=status.HTTP_201_CREATED)
 
 
 def conversation_detail(request, conversation_id):
-    logger.info("conversation_detail request", request)
+    logger.info("conversation_detail request")
     conv = Conversation.objects.get(id=conversation_id)
     serializer = ConversationSerializer(conv)
-    return render(request, "chat_room.html", {"conversation": serializer.data})    
+    return render(request, "chat_room.html", {"conversation": serializer.data})
+
+
+def conversation_messages(request, conversation_id):
+    """
+    Return one page of a conversation's messages, oldest first within the page.
+
+    Pages walk back in time with a keyset cursor over (timestamp, id), so the
+    cost of a page does not depend on how deep into the history it is.
+    """
+    logger.info("conversation_messages request")
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    if not ConversationParticipant.objects.filter(conversation_id=conversation_id, user=request.user).exists():
+        return JsonResponse({"detail": "You are not a participant of this conversation."}, status=status.HTTP_403_FORBIDDEN)
+
+    limit = page_limit(request.GET.get("limit"), settings.CHAT_HISTORY_PAGE_SIZE, settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+    messages = (
+        Message.objects.filter(conversation_id=conversation_id)
+        .select_related("sender")
+        .order_by("-timestamp", "-id")
+    )
+    cursor = request.GET.get("before")
+    if cursor:
+        try:
+            timestamp, message_id = decode_cursor(cursor)
+            timestamp, message_id = parse_datetime(timestamp), int(message_id)
+        except (InvalidCursor, TypeError, ValueError):
+            timestamp = None
+        if timestamp is None:
+            return JsonResponse({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        # Keep the range condition on timestamp alone so it can seek the
+        # composite index; ties on timestamp are resolved by id.
+        messages = messages.filter(timestamp__lte=timestamp).exclude(Q(timestamp=timestamp) & Q(id__gte=message_id))
+
+    page = list(messages[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].timestamp.isoformat(), page[-1].id)
+    page.reverse()
+    return JsonResponse(
+        {"messages": MessagePageSerializer(page, many=True).data, "next_cursor": next_cursor},
+        status=status.HTTP_200_OK,
+    )
+
+
+# Control characters cannot occur in escaped text, so ts_headline marks
+# matches with them and they are swapped for tags after escaping.
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+
+
+def search_messages(request):
+    """
+    Full-text search over the caller's conversations, best matches first.
+
+    Hits are ranked with ts_rank and paged with a keyset cursor over
+    (rank, id). Each hit carries an HTML-escaped snippet with the matched
+    terms wrapped in ``<mark>``.
+    """
+    logger.info("search_messages request")
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    text = request.GET.get("q", "").strip()
+    if not text:
+        return JsonResponse({"detail": "A search query is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+    limit = page_limit(request.GET.get("limit"), settings.CHAT_SEARCH_PAGE_SIZE, settings.CHAT_SEARCH_MAX_PAGE_SIZE)
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+    conversations = ConversationParticipant.objects.filter(user=request.user).values("conversation_id")
+    conversation_id = request.GET.get("conversation")
+    if conversation_id:
+        if not conversation_id.isdigit():
+            return JsonResponse({"detail": "Invalid conversation."}, status=status.HTTP_400_BAD_REQUEST)
+        conversations = conversations.filter(conversation_id=conversation_id)
+    hits = (
+        Message.objects.filter(conversation_id__in=conversations, search_vector=query)
+        # Compare ranks as double precision so cursor values round-trip exactly.
+        .annotate(rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+        .order_by("-rank", "-id")
+    )
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            rank, message_id = decode_cursor(cursor)
+            rank, message_id = float(rank), int(message_id)
+        except (InvalidCursor, TypeError, ValueError):
+            return JsonResponse({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        hits = hits.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id))
 
+    page = list(
+        hits.annotate(
+            headline=SearchHeadline(
+                "content", query, config=SEARCH_CONFIG,
+                start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP,
+            ),
+            user=F("sender__first_name"),
+        ).values("id", "conversation_id", "seq", "sender_id", "user", "timestamp", "rank", "headline")[:limit + 1]
+    )
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]["rank"], page[-1]["id"])
+    for hit in page:
+        hit["headline"] = escape(hit["headline"]).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+    return JsonResponse({"results": page, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 
+def presence(request):
+    """
+    Return the online members of many conversations in one round trip.
 
+    ``conversation_ids`` is a comma separated list; it is narrowed to the
+    caller's own conversations and defaults to all of them.
+    """
+    logger.info("presence request")
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    conversations = ConversationParticipant.objects.filter(user=request.user)
+    requested = request.GET.get("conversation_ids")
+    if requested:
+        requested = [conversation_id for conversation_id in requested.split(",") if conversation_id.isdigit()]
+        conversations = conversations.filter(conversation_id__in=requested)
+    conversation_ids = [
+        str(conversation_id)
+        for conversation_id in conversations.values_list("conversation_id", flat=True)[:settings.CHAT_PRESENCE_MAX_QUERY]
+    ]
+    online = async_to_sync(get_presence_store().online)(conversation_ids)
+    return JsonResponse({"online": online}, status=status.HTTP_200_OK)
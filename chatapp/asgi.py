@@ -12,17 +12,22 @@ import django
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-import chat.routing
 from channels.security.websocket import AllowedHostsOriginValidator
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatapp.settings')
 django.setup()
 
+# These import models, so they have to wait for the app registry.
+import chat.routing  # noqa: E402
+from chat.lifespan import lifespan  # noqa: E402
+
 application = ProtocolTypeRouter({
     'http': get_asgi_application(),
     'websocket': AllowedHostsOriginValidator(AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
-    ))
+    )),
+    # Drains the message and read receipt writers when a worker stops.
+    'lifespan': lifespan,
 })
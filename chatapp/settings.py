@@ -85,9 +85,12 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "chatapp.wsgi.application"
 ASGI_APPLICATION = 'chatapp.asgi.application'
+# The pub/sub layer keeps each worker's group members in process and
+# subscribes once per group, so a room broadcast is a single PUBLISH that
+# every worker fans out locally instead of one queue write per member.
 CHANNEL_LAYERS = {
     "default":{
-        "BACKEND":"channels_redis.core.RedisChannelLayer",
+        "BACKEND":"channels_redis.pubsub.RedisPubSubChannelLayer",
         "CONFIG":{
             "hosts":[(os.getenv('REDIS_HOST', '0.0.0.0'),6379)]
         }
@@ -177,4 +180,109 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+CHAT_HISTORY = {
+    "BACKEND": "chat.history.RedisHistoryStore",
+    "CONFIG": {
+        "max_length": int(os.getenv("CHAT_HISTORY_MAX_LENGTH", 500)),
+        "dedupe_ttl": 300,
+        # Rooms leave Redis this many seconds after their last message;
+        # older history is read from the archive.
+        "max_age": int(os.getenv("CHAT_HISTORY_MAX_AGE", 24 * 3600)),
+        "archive": "chat.archive.ArchivedHistory",
+    },
+}
+
+CHAT_MESSAGE_WRITER = {
+    "batch_size": int(os.getenv("CHAT_MESSAGE_BATCH_SIZE", 200)),
+    "flush_interval": float(os.getenv("CHAT_MESSAGE_FLUSH_INTERVAL", 0.5)),
+    "max_queue_size": int(os.getenv("CHAT_MESSAGE_QUEUE_SIZE", 10000)),
+}
+
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+CHAT_RESUME_MAX_MESSAGES = 500
+CHAT_SEARCH_PAGE_SIZE = 20
+CHAT_SEARCH_MAX_PAGE_SIZE = 100
+
+CHAT_RATE_LIMITER = {
+    "BACKEND": "chat.ratelimit.RedisRateLimiter",
+    "CONFIG": {
+        "limits": {
+            "message": {"rate": 1, "burst": 1},
+            "typing": {"rate": 5, "burst": 5},
+            "join": {"rate": 0.5, "burst": 3},
+        },
+    },
+}
+
+CHAT_READ_RECEIPTS = {
+    "flush_interval": float(os.getenv("CHAT_READ_RECEIPTS_FLUSH_INTERVAL", 1.0)),
+}
+
+CHAT_TYPING = {
+    "ttl": float(os.getenv("CHAT_TYPING_TTL", 6)),
+    "min_interval": float(os.getenv("CHAT_TYPING_MIN_INTERVAL", 0.25)),
+}
+
+CHAT_PRESENCE = {
+    "BACKEND": "chat.presence.RedisPresenceStore",
+    "CONFIG": {
+        "timeout": int(os.getenv("CHAT_PRESENCE_TIMEOUT", 60)),
+    },
+}
+
+CHAT_PRESENCE_MAX_QUERY = 200
+
+CHAT_MEMBERSHIP = {
+    "BACKEND": "chat.membership.RedisMembershipIndex",
+}
+
+CHAT_DIRECTORY_PAGE_SIZE = 50
+CHAT_DIRECTORY_MAX_PAGE_SIZE = 200
+
+CHAT_REDIS = {
+    "URL": f"redis://{os.getenv('REDIS_HOST', '0.0.0.0')}:6379/1",
+    "MAX_CONNECTIONS": int(os.getenv("CHAT_REDIS_MAX_CONNECTIONS", 50)),
+    "POOL_TIMEOUT": 5,
+}
+
+CHAT_BATCH_MAX_WINDOW_MS = 50
+CHAT_BATCH_MAX_EVENTS = 100
+
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", 256))
+CHAT_SLOW_CONSUMER_GRACE = 10
+
+# Per-action share of consumer log events to keep; unlisted actions are
+# always logged. Kept events carry the rate as ``sample_rate``.
+CHAT_LOG_SAMPLING = {
+    "typing": 0.01,
+    "stop_typing": 0.01,
+    "ping": 0.01,
+    "read": 0.05,
+}
+
+# JSON lines on stdout, formatted and written off the event loop by
+# chat.log.QueueLogHandler.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {
+            "()": "pythonjsonlogger.json.JsonFormatter",
+            "fmt": "%(asctime)s %(levelname)s %(name)s %(message)s",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "chat.log.QueueLogHandler",
+            "stream": "ext://sys.stdout",
+            "formatter": "json",
+        },
+    },
+    "root": {
+        "handlers": ["console"],
+        "level": os.getenv("LOG_LEVEL", "INFO"),
+    },
+}
@@ -22,4 +22,5 @@ from django_prometheus import urls as prometheus_urls
 urlpatterns = [
     path("", include("chat.urls")),
     path("admin/", admin.site.urls),
+    path("", include(prometheus_urls)),
 ]
@@ -0,0 +1,23 @@
+import os
+import shutil
+from prometheus_client import multiprocess
+
+# Each worker writes its metrics to PROMETHEUS_MULTIPROC_DIR, and /metrics
+# (django_prometheus's ExportToDjangoView) aggregates all of them, so a
+# scrape sees the whole server rather than whichever worker answered it.
+workers = 3
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = "0.0.0.0:8000"
+
+
+def on_starting(server):
+    # Files left by a previous run would be summed into the new one.
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)